@@ -0,0 +1,182 @@
+import asyncio
+import base64
+import os
+import ssl
+import time
+from urllib.parse import urlsplit
+
+from check_proxies import TEST_URL, TIMEOUT
+from proxy_pool import ProxyPool, PROXY_POOL_PATH
+
+# Errors worth a second attempt: slow or overloaded proxies, not dead ones
+RETRYABLE_ERRORS = (asyncio.TimeoutError, TimeoutError, ConnectionResetError, asyncio.IncompleteReadError)
+
+
+def _split_proxy(proxy):
+    # "user:pass@ip:port" -> ("ip", port, "user:pass"); ValueError if malformed
+    auth, _, host_port = proxy.rpartition("@")
+    host, _, port = host_port.rpartition(":")
+    if not host:
+        raise ValueError(f"Malformed proxy: {proxy!r}")
+    return host, int(port), auth
+
+
+def _proxy_host(proxy):
+    # host part for per-host limits, never raising
+    return proxy.rpartition("@")[2].rpartition(":")[0]
+
+
+async def _read_status(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError("Proxy closed the connection")
+    status = int(line.decode("latin-1").split()[1])
+    while await reader.readline() not in (b"\r\n", b"\n", b""):
+        pass
+    return status
+
+
+async def check_proxy(proxy, url=TEST_URL, timeout=TIMEOUT, ssl_context=None):
+    """
+    Fetch `url` through `proxy` (CONNECT tunnel for https, absolute-form GET for http).
+
+    :return: Result dict in the check_proxies format, plus "retryable" on failures
+    """
+    target = urlsplit(url)
+    path = (target.path or "/") + (f"?{target.query}" if target.query else "")
+
+    async def request():
+        host, port, auth = _split_proxy(proxy)
+        auth_header = f"Proxy-Authorization: Basic {base64.b64encode(auth.encode()).decode()}\r\n" if auth else ""
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            if target.scheme == "https":
+                authority = f"{target.hostname}:{target.port or 443}"
+                writer.write(f"CONNECT {authority} HTTP/1.1\r\nHost: {authority}\r\n{auth_header}\r\n".encode())
+                await writer.drain()
+                status = await _read_status(reader)
+                if status != 200:
+                    return status
+                await writer.start_tls(ssl_context or ssl.create_default_context(), server_hostname=target.hostname)
+                request_line, extra_headers = f"GET {path} HTTP/1.1", ""
+            else:
+                request_line, extra_headers = f"GET {url.split('#')[0]} HTTP/1.1", auth_header
+            writer.write(f"{request_line}\r\nHost: {target.netloc}\r\nConnection: close\r\n{extra_headers}\r\n".encode())
+            await writer.drain()
+            return await _read_status(reader)
+        finally:
+            writer.close()
+
+    start = time.time()
+    try:
+        async with asyncio.timeout(timeout):
+            status = await request()
+        return {"proxy": proxy, "ok": status == 200, "latency": time.time() - start, "status": status}
+    except Exception as e:
+        return {"proxy": proxy, "ok": False, "latency": None, "error": f"{type(e).__name__}: {e}",
+                "retryable": isinstance(e, RETRYABLE_ERRORS)}
+
+
+async def iter_validate(proxy_list, url=TEST_URL, timeout=TIMEOUT, concurrency=500, per_host=20,
+                        max_attempts=2, target_good=None):
+    """
+    Validate proxies concurrently and yield each final result as soon as it is known.
+
+    Timeouts and dropped connections are retried (up to `max_attempts`, each with
+    a 1.5x longer timeout) after the proxies queued before them, instead of in a
+    second full sweep. Stops early once `target_good` proxies passed.
+
+    :param concurrency: Global limit on open checks
+    :param per_host: Limit on open checks per proxy IP
+    """
+    proxies = list(dict.fromkeys(proxy_list))
+    if not proxies:
+        return
+    work = asyncio.Queue()
+    for p in proxies:
+        work.put_nowait((p, 1, timeout))
+    results = asyncio.Queue()
+    host_limits = {}
+
+    async def worker():
+        while True:
+            proxy, attempt, attempt_timeout = await work.get()
+            limit = host_limits.setdefault(_proxy_host(proxy), asyncio.Semaphore(per_host))
+            try:
+                async with limit:
+                    res = await check_proxy(proxy, url, attempt_timeout)
+            except Exception as e:  # every proxy must produce a result, or the loop below waits forever
+                res = {"proxy": proxy, "ok": False, "latency": None, "error": f"{type(e).__name__}: {e}"}
+            retryable = res.pop("retryable", False)
+            if retryable and attempt < max_attempts:
+                work.put_nowait((proxy, attempt + 1, attempt_timeout * 1.5))
+                continue
+            res["attempts"] = attempt
+            results.put_nowait(res)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(proxies)))]
+    good = 0
+    try:
+        for _ in range(len(proxies)):
+            res = await results.get()
+            yield res
+            if res["ok"]:
+                good += 1
+                if target_good and good >= target_good:
+                    break
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+def validate_proxies(proxy_list, **kwargs):
+    """
+    Drop-in for check_proxies.validate_proxies (e.g. as ProxyPool.revalidate's validate_fn).
+
+    :return: (good, bad) lists of result dicts
+    """
+    async def collect():
+        good, bad = [], []
+        async for res in iter_validate(proxy_list, **kwargs):
+            (good if res["ok"] else bad).append(res)
+        return good, bad
+
+    return asyncio.run(collect())
+
+
+async def main(proxy_list, path="valid_proxies.txt", target_good=None):
+    pool = ProxyPool.load(PROXY_POOL_PATH) if os.path.exists(PROXY_POOL_PATH) else ProxyPool([])
+    pool.add(proxy_list)
+    good = 0
+    start = time.time()
+    # Write good proxies as they arrive so the scraper can start on a partial list
+    with open(path, "w") as f:
+        async def test(proxies):
+            nonlocal good
+            failed = []
+            async for res in iter_validate(proxies, target_good=target_good and target_good - good):
+                if res["ok"]:
+                    pool.report(res["proxy"], True, res["latency"])
+                    good += 1
+                    f.write(res["proxy"] + "\n")
+                    f.flush()
+                else:
+                    pool.trip(res["proxy"])  # not picked until it passes again
+                    failed.append(res["proxy"])
+            return failed
+
+        bad = await test(proxy_list)
+        # 2nd time for bad proxies, as check_proxies does
+        dead = await test(bad) if bad and not (target_good and good >= target_good) else []
+    print(f"Valid proxies: {good}, Invalid proxies: {len(bad)}, failed twice: {len(dead)}, "
+          f"took {time.time() - start:.1f}s")
+    # Failed both tests: keep them out of the saved pool (and the scraper's retry budget)
+    pool.remove(dead)
+    pool.save(PROXY_POOL_PATH)
+
+
+if __name__ == "__main__":
+    with open("proxies_list.txt", "r") as f:
+        proxy_list = [line.strip() for line in f if line.strip()][3:]
+    asyncio.run(main(proxy_list))
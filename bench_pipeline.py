@@ -0,0 +1,328 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from stub_server import F10_PATH, PAGE_FIXTURES, StubProxy, save_page, start_stub_server
+
+BASELINE_PATH = "bench_baselines.json"
+REGRESSION_TOLERANCE = 0.2  # flag a metric 20% worse than its baseline
+N_DATES = 10
+N_GROUPS = 5
+N_ITEMS = 8  # per group
+FUND_PAGE = '<html><body><div id="app"><div>基金概况</div><table><tr><td>基金代码</td></tr></table></div></body></html>'
+
+
+def _report_dates(n_dates):
+    return [f"{24 - i // 2:02d}-{'12-31' if i % 2 == 0 else '06-30'}" for i in range(n_dates)]
+
+
+def _row(cells, tag="td"):
+    return "<tr>" + "".join(f"<{tag}>{c}</{tag}>" for c in cells) + "</tr>"
+
+
+def _amount(rng):
+    value = rng.uniform(-1e10, 1e10)
+    return f"{value / 1e8:.2f}亿" if abs(value) >= 1e8 else f"{value / 1e4:.2f}万"
+
+
+def make_table(table_name, rng, n_dates=N_DATES, n_groups=N_GROUPS, n_items=N_ITEMS):
+    """
+    A commonTable laid out as the F10 page renders it: zyzb and zcfzb have one header row of dates
+    under 截止日期, lrb and xjllb two with the dates in the second. Statements start with a 年结日 row
+    and list their items in groups, each under a row spanning the table and closed by a 总额 row.
+    """
+    dates = _report_dates(n_dates)
+    if table_name in ['lrb', 'xjllb']:
+        kinds = [f"{'年报' if d.endswith('12-31') else '中报'}{d[:2]}" for d in dates]
+        head = '<tr><th rowspan="2">报表截止日</th>' + "".join(f"<th>{k}</th>" for k in kinds) + "</tr>" + _row(dates, "th")
+    else:
+        head = _row(['截止日期'] + dates, "th")
+    if table_name == 'zyzb':
+        body = [_row([f"指标{k}(%)"] + [f"{rng.uniform(-50, 50):.2f}" for _ in dates]) for k in range(n_groups * n_items)]
+    else:
+        body = [_row(['年结日'] + ['12-31'] * len(dates))]
+        for g in range(n_groups):
+            body.append(f'<tr><td colspan="{len(dates) + 1}">项目组{g}</td></tr>')
+            body += [_row([f"项目{k}"] + [_amount(rng) if rng.random() > 0.05 else "--" for _ in dates])
+                     for k in range(n_items)]
+            body.append(_row([f"项目组{g}总额"] + [_amount(rng) for _ in dates]))
+    return f'<table class="commonTable"><thead>{head}</thead><tbody>{"".join(body)}</tbody></table>'
+
+
+def make_page(rng):
+    """A rendered NewFinancialAnalysis page, as recorded by BrowserFetcher: unit and the four tables."""
+    import east_money_scraper as ems
+
+    sections = "".join(f'<div class="content {name}">{make_table(name.split("_")[-1], rng)}</div>'
+                       for name in ems.content_list)
+    return f'<html><body><div id="app"><span>币种：港元</span>{sections}</div></body></html>'
+
+
+def make_fixtures(fixtures_dir, n_stocks, fund_every=20, seed=0):
+    """
+    Write synthetic fixtures in the recorded layout: rendered F10 pages, the HKEX stock
+    list page and the F10 page shell. Every `fund_every`-th stock is a fund.
+
+    :return: Stock codes in the list
+    """
+    rng = random.Random(seed)
+    stocks = [f"{i:05d}" for i in range(1, n_stocks + 1)]
+    for i, stock_code in enumerate(stocks):
+        is_fund = fund_every and i % fund_every == fund_every - 1
+        save_page(fixtures_dir, stock_code, FUND_PAGE if is_fund else make_page(rng))
+
+    rows = "".join(f"<tr><td>{s}</td><td>公司{s}</td><td>100</td></tr>" for s in stocks)
+    pages = {
+        "/stocklist_active_main_c.htm": (
+            '<html><body><table class="table-stocklist"><thead><tr><th>股份代號</th><th>股份簡稱</th>'
+            f'<th>買賣單位</th></tr></thead><tbody>{rows}</tbody></table></body></html>'),
+        F10_PATH: '<html><body><div id="app">NewFinancialAnalysis</div></body></html>',
+    }
+    for url_path, html in pages.items():
+        path = os.path.join(fixtures_dir, PAGE_FIXTURES[url_path])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(html)
+    return stocks
+
+
+def _usage():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_seconds": self_usage.ru_utime + self_usage.ru_stime + children.ru_utime + children.ru_stime,
+        "peak_rss_mb": max(self_usage.ru_maxrss, children.ru_maxrss) / 1024,  # ru_maxrss is in KB on Linux
+    }
+
+
+def _latency_stats(latencies):
+    if not latencies:
+        return {}
+    return {"p50_ms": float(np.percentile(latencies, 50) * 1000), "p99_ms": float(np.percentile(latencies, 99) * 1000)}
+
+
+def stage_stock_list(base_url, work_dir):
+    """Read the HKEX list page with get_all_stock_code and save hk_stock_list_short.csv."""
+    import get_all_stock_code
+
+    start = time.time()
+    df = get_all_stock_code.short_list(get_all_stock_code.read_stock_list_http(base_url + "/stocklist_active_main_c.htm"))
+    df.to_csv(os.path.join(work_dir, "hk_stock_list_short.csv"), index=False)
+    return {"seconds": time.time() - start, "stocks": len(df)}
+
+
+def stage_check_proxies(n_proxies):
+    """Validate a mixed list of stub proxies with the asyncio validator."""
+    import async_check_proxies
+    from bench_proxy_validator import TEST_URL, TIMEOUT, make_proxy_list
+
+    stub = StubProxy().start()
+    try:
+        proxy_list = make_proxy_list(stub, n_proxies)
+        start = time.time()
+        good, bad = async_check_proxies.validate_proxies(proxy_list, url=TEST_URL, timeout=TIMEOUT, per_host=n_proxies)
+        elapsed = time.time() - start
+    finally:
+        stub.stop()
+    latencies = [p["latency"] for p in good if p.get("latency") is not None]
+    return dict({"seconds": elapsed, "proxies": n_proxies, "good": len(good),
+                 "proxies_per_sec": n_proxies / elapsed}, **_latency_stats(latencies))
+
+
+class TimedFetcher:
+    """Fetch backend wrapper recording the latency of every fetch_payload call."""
+
+    def __init__(self, fetcher, latencies, lock):
+        self.fetcher = fetcher
+        self.latencies = latencies
+        self.lock = lock
+
+    def fetch_payload(self, stock_code):
+        start = time.time()
+        result = self.fetcher.fetch_payload(stock_code)
+        with self.lock:
+            self.latencies.append(time.time() - start)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.fetcher, name)
+
+
+def stage_scrape(page_url, work_dir, workers, max_tries, parse_workers=0, paced=False, browser=False):
+    """
+    Run east_money_scraper.run_scraper, with its job store, driver pool, pipeline and partition
+    writer, on the F10 pages of the stub. The pages are read by PageReplayFetcher, which parses
+    them as the scraper does but without a browser, or with `browser` by BrowserFetcher on headless
+    Chrome, the production backend. Latencies are fetch latencies.
+
+    :param paced: Pace requests with the scraper's RateLimiter; unpaced by default, to measure the pipeline
+    """
+    import east_money_scraper as ems
+    from coverage_manifest import CoverageManifest
+    from job_store import JobFeed, JobStore
+    from partition_writer import PartitionWriter
+    from proxy_pool import ProxyPool
+    from rate_limiter import RateLimiter
+
+    run_dir = work_dir
+    make_fetcher = lambda slot: ems.PageReplayFetcher(page_url)
+    if browser:
+        ems.F10_URL = page_url
+        try:
+            ems.make_driver_with_proxy(None).quit()
+        except Exception as e:
+            return {"skipped": f"headless Chrome did not start ({type(e).__name__})"}
+        run_dir = os.path.join(work_dir, "browser")  # the transform stage reads the replay stage's partitions
+        os.makedirs(run_dir, exist_ok=True)
+        make_fetcher = lambda slot: ems.BrowserFetcher(ems.make_driver_with_proxy(None))
+
+    stock_list = pd.read_csv(os.path.join(work_dir, "hk_stock_list_short.csv"), dtype={"股份代號": str})["股份代號"].tolist()
+    db_path = os.path.join(run_dir, "scrape_state.db")
+    store = JobStore(db_path)
+    store.enqueue(stock_list)
+    feed = JobFeed(store, owner="bench")
+    writer = PartitionWriter(os.path.join(run_dir, "partitions"), on_flush=store.complete,
+                             manifest=CoverageManifest(db_path))
+    latencies = []
+    lock = threading.Lock()
+    # no waits and no backoff: only the stub's latency and failures slow the workers down
+    limiter = RateLimiter() if paced else RateLimiter(global_rate=1e9, proxy_rate=1e9, global_max_rate=1e9,
+                                                        proxy_max_rate=1e9, backoff_base=0)
+
+    # one direct connection per worker: the pool runs as many workers as it has proxies
+    slots = ProxyPool([f"direct-{n}" for n in range(workers)])
+    start = time.time()
+    success_stocks, fail_stocks, _ = ems.run_scraper(
+        store, feed, slots, writer, fetcher_factory=lambda slot: TimedFetcher(make_fetcher(slot), latencies, lock),
+        num_workers=workers, parse_workers=parse_workers, max_tries=max_tries, limiter=limiter)
+    elapsed = time.time() - start
+    store.close()
+    return dict({"seconds": elapsed, "stocks": len(stock_list), "stocks_per_sec": len(stock_list) / elapsed,
+                 "ok": len(success_stocks), "failed": len(fail_stocks)}, **_latency_stats(latencies))
+
+
+def stage_transform(work_dir, max_workers):
+    """Compact the partitions and run transform_finance_data on them."""
+    import partition_writer
+    import transform_finance_data as tfd
+
+    finance_path = os.path.join(work_dir, "finance_data")
+    start = time.time()
+    partition_writer.compact(os.path.join(work_dir, "partitions"), finance_path)
+    stock_df = pd.read_csv(os.path.join(work_dir, "hk_stock_list_short.csv"), dtype={"股份代號": str})
+    counts = tfd.run_pipeline(finance_path, os.path.join(work_dir, "transformed_finance_data"), stock_df,
+                              max_workers=max_workers)
+    elapsed = time.time() - start
+    return {"seconds": elapsed, "rows": int(sum(counts.values())), "rows_per_sec": sum(counts.values()) / elapsed}
+
+
+def _measured(fn, *args):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # per-stock progress lines
+        result = fn(*args)
+    if "skipped" not in result:
+        result.update(_usage())
+    return result
+
+
+def run_stage(fn, *args):
+    """Run a stage in a fresh process so its CPU time and peak RSS are its own."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(_measured, fn, *args).result()
+
+
+# Metrics compared with the baseline: name -> True if higher is better
+COMPARED_METRICS = {"stocks_per_sec": True, "proxies_per_sec": True, "rows_per_sec": True,
+                    "p50_ms": False, "p99_ms": False, "peak_rss_mb": False, "cpu_seconds": False}
+
+
+def compare(results, baseline):
+    """
+    :return: List of regression messages
+    """
+    regressions = []
+    for stage, metrics in results.items():
+        for name, higher_is_better in COMPARED_METRICS.items():
+            old, new = baseline.get(stage, {}).get(name), metrics.get(name)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change < -REGRESSION_TOLERANCE) if higher_is_better else (change > REGRESSION_TOLERANCE):
+                regressions.append(f"{stage}.{name}: {old:.2f} -> {new:.2f} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against a local stub server.")
+    parser.add_argument("--stocks", type=int, default=200)
+    parser.add_argument("--proxies", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=50, help="latency added to every stub response")
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--failure-rate", type=float, default=0.02, help="share of stub responses that are 503")
+    parser.add_argument("--workers", type=int, default=4, help="scraper workers")
+    parser.add_argument("--parse-workers", type=int, default=2,
+                        help="scraper parse/transform processes, 0 to parse in the fetch threads")
+    parser.add_argument("--max-tries", type=int, default=3, help="scraper attempts per stock")
+    parser.add_argument("--paced", action="store_true", help="pace the scraper with its rate limiter")
+    parser.add_argument("--transform-workers", type=int, default=None)
+    parser.add_argument("--fixtures", default=None,
+                        help="fixtures dir recorded with east_money_scraper.RECORD_DIR; synthetic pages if omitted")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    args = parser.parse_args()
+
+    # every knob but --save, so results are only compared with a baseline of the same setup
+    config = ",".join(f"{name}={value}" for name, value in sorted(vars(args).items()) if name != "save")
+    with tempfile.TemporaryDirectory() as work_dir:
+        fixtures_dir = args.fixtures or os.path.join(work_dir, "fixtures")
+        if not args.fixtures:
+            make_fixtures(fixtures_dir, args.stocks)
+        server, base_url = start_stub_server(fixtures_dir, latency=args.latency_ms / 1000,
+                                             jitter=args.jitter_ms / 1000)
+        try:
+            results = {"stock_list": run_stage(stage_stock_list, base_url, work_dir)}
+            server.failure_rate = args.failure_rate  # the list page is fetched once, without retries
+            results["check_proxies"] = run_stage(stage_check_proxies, args.proxies)
+            results["scrape_replay"] = run_stage(stage_scrape, base_url + F10_PATH, work_dir, args.workers,
+                                                 args.max_tries, args.parse_workers, args.paced)
+            results["scrape_browser"] = run_stage(stage_scrape, base_url + F10_PATH, work_dir, args.workers,
+                                                  args.max_tries, args.parse_workers, args.paced, True)
+            results["transform"] = run_stage(stage_transform, work_dir, args.transform_workers)
+        finally:
+            server.shutdown()
+
+    print(f"Benchmark ({config}) on {'recorded' if args.fixtures else 'synthetic'} F10 pages")
+    for stage, metrics in results.items():
+        print(f"  {stage:<15}" + ", ".join(f"{k} {v:.2f}" if isinstance(v, float) else f"{k} {v}"
+                                           for k, v in metrics.items()))
+    if "skipped" in results["scrape_browser"]:
+        print("Note: the Selenium backend (the scraper's default) was not measured. scrape_replay parses the "
+              "same pages without rendering them in a browser, so its numbers are an upper bound.")
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baselines = json.load(f)
+    if config in baselines:
+        regressions = compare(results, baselines[config])
+        print("Regressions vs baseline:" if regressions else "No regressions vs baseline.")
+        for r in regressions:
+            print("  " + r)
+    if args.save:
+        baselines[config] = results
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, ensure_ascii=False)
+        print(f"Saved baseline to {BASELINE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
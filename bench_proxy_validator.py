@@ -0,0 +1,49 @@
+import random
+import time
+import sys
+
+import async_check_proxies
+import check_proxies
+from stub_server import StubProxy
+
+# Mix of proxy behaviours roughly matching a public proxy list
+MIX = {"ok": 0.15, "slow300": 0.1, "slow1500": 0.05, "flaky50": 0.1, "dead": 0.3, "hang": 0.1, "closed": 0.2}
+TEST_URL = "http://example.invalid/PC_HKF10/pages/home/index.html?code=00700"
+TIMEOUT = 1
+
+
+def make_proxy_list(stub, n, seed=0):
+    rng = random.Random(seed)
+    behaviours = rng.choices(list(MIX), weights=list(MIX.values()), k=n)
+    # port 9 (discard) is closed on a normal box: connection refused
+    return ["127.0.0.1:9" if b == "closed" else stub.proxy(b, i) for i, b in enumerate(behaviours)]
+
+
+def bench_threaded(proxy_list):
+    check_proxies.TEST_URL, check_proxies.TIMEOUT = TEST_URL, TIMEOUT
+    start = time.time()
+    good, bad = check_proxies.validate_proxies(proxy_list)
+    good2, bad2 = check_proxies.validate_proxies([p["proxy"] for p in bad])  # the old second sweep
+    return time.time() - start, len(good) + len(good2)
+
+
+def bench_async(proxy_list, **kwargs):
+    start = time.time()
+    good, bad = async_check_proxies.validate_proxies(proxy_list, url=TEST_URL, timeout=TIMEOUT, **kwargs)
+    return time.time() - start, len(good)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    stub = StubProxy().start()
+    proxy_list = make_proxy_list(stub, n)
+    print(f"{n} proxies: " + ", ".join(f"{b} {w:.0%}" for b, w in MIX.items()))
+
+    elapsed, good = bench_async(proxy_list, per_host=n)
+    print(f"asyncio validator:           {elapsed:6.2f}s, {good} good, {n / elapsed:8.1f} proxies/s")
+    elapsed, good = bench_async(proxy_list, per_host=n, target_good=50)
+    print(f"asyncio, stop at 50 good:    {elapsed:6.2f}s, {good} good")
+    if n <= 5000:
+        elapsed, good = bench_threaded(proxy_list)
+        print(f"threaded validator (2 runs): {elapsed:6.2f}s, {good} good, {n / elapsed:8.1f} proxies/s")
+    stub.stop()
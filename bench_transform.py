@@ -0,0 +1,253 @@
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import pandas as pd
+
+import parquet_store
+import transform_data_for_scraper as tdfs
+import transform_finance_data as tfd
+import transform_stock_code as tsc
+
+
+def add_prefixes_loop(df):
+    """The original row-by-row add_prefixes, kept as the reference implementation."""
+    prefix = ''
+    drop_i = []
+
+    for i in range(len(df)):
+        col = df.iloc[i, 0]
+        val = df.iloc[i, 1]
+        if val == col:
+            prefix = col
+            drop_i.append(i)
+            continue
+
+        elif (col == prefix) or ('总额' in col):
+            prefix = ''
+
+        if prefix != '':
+            df.iloc[i, 0] = f"{prefix}_{col}"
+
+    keep_i = [i for i in range(len(df)) if i not in drop_i]
+    df = df.iloc[keep_i].reset_index(drop=True)
+    return df
+
+
+def parse_values_legacy(df):
+    """The original per-row unit extraction of clean_df, kept as the reference implementation."""
+    val_col = '数值'
+    df['unit'] = df[val_col].apply(lambda text: "".join(re.compile(r'[\u4E00-\u9FFF]+').findall(text)))
+    df['value'] = df[val_col].str.replace(r'[\u4E00-\u9FFF]+', '', regex=True)
+    df['value'] = pd.to_numeric(df['value'], errors='coerce')
+    df.loc[df['unit']=='万亿', 'value'] = df['value'] * 1000000000000
+    df.loc[df['unit']=='亿', 'value'] = df['value'] * 100000000
+    df.loc[df['unit']=='万', 'value'] = df['value'] * 10000
+    return df
+
+
+def clean_df_legacy(df, content_name):
+    """The original clean_df, with merges for order_index, kept as the reference implementation."""
+    df = tsc.transform_stock_code(df, '股票代码')
+    df = df.drop_duplicates()
+    if content_name in ['zcfzb', 'zyzb']:
+        df.rename(columns={'截止日期': '报表截止日'}, inplace=True)
+    df['报表截止日'] = pd.to_datetime('20'+ df['报表截止日'].astype(str), errors='coerce').dt.date
+    df['报表月'] = pd.to_datetime(df['报表截止日']).dt.month.astype(pd.Int64Dtype())
+    if '年结日' in df.columns:
+        df['年结月'] = df['年结日'].astype(str).str.split('-').str[0].astype(pd.Int64Dtype())
+        df['是否年报'] = np.where(df['报表月'] == df['年结月'], 1, 0)
+    value, unit = tfd.parse_value_units(df['数值'])
+    df['unit'] = unit
+    df['value'] = value
+    index_name_df = df[['指标组', '指标名称']].drop_duplicates().reset_index(drop=True).reset_index().rename(columns={'index': 'order_index'})
+    return pd.merge(df, index_name_df, on=['指标组', '指标名称'], how='left')
+
+
+def output_date_df_legacy(df):
+    df = tsc.transform_stock_code(df, '股票代码')
+    df['年结月'] = df['年结日'].astype(str).str.split('-').str[0].astype(pd.Int64Dtype())
+    df_1 = df[['股票代码', '年结月']].drop_duplicates()
+    df_2 = df.groupby('股票代码')['报表截止日'].max().reset_index()
+    date_df = pd.merge(df_2, df_1, on='股票代码', how='left')
+    date_df.rename(columns={'报表截止日': '最新报表截止日'}, inplace=True)
+    return date_df
+
+
+def finalize_type_legacy(combined_df, file_type, date_df, stock_df):
+    if file_type == 'zyzb':
+        combined_df = pd.merge(combined_df, date_df, on='股票代码', how='left')
+        combined_df['是否年报'] = np.where(combined_df['报表月'] == combined_df['年结月'], 1, 0)
+    else:
+        combined_df = pd.merge(combined_df, date_df[['股票代码', '最新报表截止日']], on='股票代码', how='left')
+    combined_df['是否最新报表'] = np.where(combined_df['报表截止日'] == combined_df['最新报表截止日'], 1, 0)
+    output_df = combined_df.loc[(combined_df['是否最新报表']==1) | (combined_df['是否年报']==1)]
+    output_df = pd.merge(output_df, stock_df, left_on='股票代码', right_on='股份代號')
+    save_df = output_df.sort_values(by=['股票代码','报表截止日', 'order_index'], ascending=[True, False, True]).drop_duplicates()
+    return save_df[tfd.OUTPUT_COLUMNS]
+
+
+def make_values(n, seed=0):
+    rng = random.Random(seed)
+    units = ['', '', '万', '亿', '万亿', '元', '%', '倍']
+    values = [f"{rng.uniform(-1e4, 1e4):.2f}{rng.choice(units)}" for _ in range(n)]
+    for i in rng.sample(range(n), min(n, max(1, n // 50))):
+        values[i] = rng.choice(['--', '', '亿1.5', '约1.2万', '1,234'])
+    return pd.DataFrame({'数值': values})
+
+
+def make_statement(n_rows, n_dates=10, seed=0):
+    """
+    Synthetic statement in the page layout: item name column, one column per
+    report date, group header rows repeating their name in every cell, groups
+    closed by a 总额 row or by a row repeating the header name.
+    """
+    rng = random.Random(seed)
+    dates = [f"{24 - i // 2:02d}-{'12-31' if i % 2 == 0 else '06-30'}" for i in range(n_dates)]
+    rows = []
+    while len(rows) < n_rows:
+        kind = rng.random()
+        if kind < 0.15:
+            header = f"分组{len(rows)}"
+            rows.append([header] * (n_dates + 1))
+            for j in range(rng.randint(0, 8)):
+                rows.append([f"项目{len(rows)}"] + [f"{rng.uniform(-1e3, 1e3):.2f}亿" for _ in dates])
+            closer = rng.random()
+            if closer < 0.3:
+                rows.append([f"{header}总额"] + [f"{rng.uniform(0, 1e3):.2f}万" for _ in dates])
+            elif closer < 0.5:
+                rows.append([header] + ["--"] * n_dates)
+        else:
+            rows.append([f"项目{len(rows)}"] + [f"{rng.uniform(-1e3, 1e3):.2f}" for _ in dates])
+    return pd.DataFrame(rows[:n_rows], columns=['截止日期'] + dates)
+
+
+def timed(fn, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_add_prefixes(n_rows):
+    df = make_statement(n_rows)
+    loop = timed(lambda: add_prefixes_loop(df.copy()), repeat=1)
+    vec = timed(lambda: tdfs.add_prefixes(df.copy()))
+    print(f"add_prefixes {n_rows:>7} rows: loop {loop * 1000:9.1f} ms, vectorized {vec * 1000:7.1f} ms, {loop / vec:6.1f}x")
+
+
+def bench_parse_values(n):
+    df = make_values(n)
+    legacy = timed(lambda: parse_values_legacy(df.copy()))
+    vec = timed(lambda: tfd.parse_value_units(df['数值']))
+    print(f"parse_value_units {n:>8} values: per-row {legacy * 1000:9.1f} ms, single pass {vec * 1000:7.1f} ms, {legacy / vec:6.1f}x")
+
+
+def make_raw_table(n_stocks, table_name='lrb', n_rows=60, n_dates=10):
+    """
+    Long-format raw rows as the scraper writes them, for n_stocks stocks. Every 7th stock
+    changed its fiscal year end and every 5th was scraped twice (duplicate rows).
+    """
+    frames = []
+    for i in range(n_stocks):
+        df = make_statement(n_rows, n_dates=n_dates, seed=i)
+        df = tdfs.add_prefixes(df)
+        df = df.set_index('截止日期').T.reset_index(names='报表截止日')
+        df = df.melt(id_vars=['报表截止日'], var_name='指标', value_name='数值')
+        parts = df['指标'].str.partition('_')
+        df['年结日'] = np.where((i % 7 == 3) & (df['报表截止日'] < '22'), '06-30', '12-31')
+        df['指标组'] = parts[0]
+        df['指标名称'] = parts[2].where(parts[1] == '_', parts[0])
+        df['股票代码'] = f"{i:05d}"
+        df['币种'] = '港元'
+        df = df.drop(columns=['指标'])
+        frames.append(pd.concat([df, df.iloc[:n_rows]]) if i % 5 == 0 else df)
+    df = pd.concat(frames, ignore_index=True)
+    if table_name == 'zyzb':
+        df = df.drop(columns=['年结日'])
+    if table_name in ['zyzb', 'zcfzb']:
+        df = df.rename(columns={'报表截止日': '截止日期'})
+    return df
+
+
+def make_stock_df(n_stocks):
+    stocks = [f"{i:05d}" for i in range(n_stocks) if i % 11 != 4]  # some stocks are no longer listed
+    return pd.DataFrame({'股份代號': stocks, '股份簡稱': [f"公司{s}" for s in stocks]})
+
+
+def transform_legacy(raw, lrb, file_type, stock_df):
+    date_df = output_date_df_legacy(clean_df_legacy(lrb.copy(), 'lrb'))
+    return finalize_type_legacy(clean_df_legacy(raw.copy(), file_type), file_type, date_df, stock_df)
+
+
+def transform_current(raw, lrb, file_type, stock_df):
+    date_df = tfd.output_date_df(tfd.clean_df(lrb.copy(), 'lrb'))
+    return tfd.finalize_type(tfd.clean_df(raw.copy(), file_type), file_type, date_df, stock_df)
+
+
+def check_derived_flags(n_stocks=60):
+    lrb = make_raw_table(n_stocks, 'lrb', n_rows=30, n_dates=8)
+    stock_df = make_stock_df(n_stocks)
+    for file_type in ['lrb', 'zcfzb', 'xjllb', 'zyzb']:
+        raw = make_raw_table(n_stocks, file_type, n_rows=30, n_dates=8)
+        expected = transform_legacy(raw, lrb, file_type, stock_df).reset_index(drop=True)
+        actual = transform_current(raw, lrb, file_type, stock_df).reset_index(drop=True)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    print(f"derived flags: outputs match the merge-based transform for every type on {n_stocks} stocks")
+
+
+def bench_storage(n_stocks):
+    df = make_raw_table(n_stocks)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path, parquet_path = os.path.join(tmp, 'lrb.csv'), os.path.join(tmp, 'lrb.parquet')
+        df.to_csv(csv_path, index=False)
+        parquet_store.write_parquet(df, parquet_path)
+        csv_size, parquet_size = os.path.getsize(csv_path), os.path.getsize(parquet_path)
+        csv_load = timed(lambda: tfd.read_raw(csv_path, tfd.RAW_COLUMNS))
+        parquet_load = timed(lambda: tfd.read_raw(parquet_path, tfd.RAW_COLUMNS))
+        date_load = timed(lambda: tfd.read_raw(parquet_path, tfd.DATE_COLUMNS, ['00001']))
+    print(f"storage {len(df):>8} rows: csv {csv_size / 1e6:6.1f} MB {csv_load * 1000:7.1f} ms, "
+          f"parquet {parquet_size / 1e6:6.1f} MB {parquet_load * 1000:7.1f} ms, "
+          f"one stock's dates {date_load * 1000:6.1f} ms")
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_derived_flags(n_stocks, file_type='zcfzb'):
+    lrb = make_raw_table(n_stocks, 'lrb')
+    raw = make_raw_table(n_stocks, file_type)
+    stock_df = make_stock_df(n_stocks)
+    legacy = timed(lambda: transform_legacy(raw, lrb, file_type, stock_df), repeat=1)
+    current = timed(lambda: transform_current(raw, lrb, file_type, stock_df), repeat=1)
+    legacy_mem = peak_memory(lambda: transform_legacy(raw, lrb, file_type, stock_df))
+    current_mem = peak_memory(lambda: transform_current(raw, lrb, file_type, stock_df))
+    print(f"derived flags {len(raw):>8} rows: merges {legacy * 1000:8.1f} ms {legacy_mem / 1e6:7.1f} MB peak, "
+          f"single pass {current * 1000:8.1f} ms {current_mem / 1e6:7.1f} MB peak, {legacy / current:5.1f}x")
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [100, 1000, 10000]
+    check_derived_flags()
+    for n in sizes:
+        bench_add_prefixes(n)
+    for n in sizes:
+        bench_parse_values(n * 100)
+    for n in sizes:
+        bench_storage(max(1, n // 10))
+    for n in sizes:
+        bench_derived_flags(max(1, n // 10))
@@ -1,5 +1,6 @@
-import requests, time
+import requests, time, os
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from proxy_pool import ProxyPool, PROXY_POOL_PATH
 
 stock_code = "00700"
 TEST_URL = "https://emweb.securities.eastmoney.com/PC_HKF10/pages/home/index.html?code={stock_code}&type=web&color=w#/NewFinancialAnalysis"
@@ -37,14 +38,22 @@ def save_proxies(path, proxies):
 if __name__ == "__main__":
     with open("proxies_list.txt", "r") as f:
         proxy_list = [line.strip() for line in f if line.strip()][3:]
+    # Keep the scores the scraper has collected and add the new proxies
+    pool = ProxyPool.load(PROXY_POOL_PATH) if os.path.exists(PROXY_POOL_PATH) else ProxyPool([])
+    pool.add(proxy_list)
     # 1st time
-    good, bad = validate_proxies(proxy_list)
+    good, bad = pool.revalidate(validate_proxies)
     print(f"After 1st test - Valid proxies: {len(good)}, Invalid proxies: {len(bad)}")
     # 2nd time for bad proxies
     if bad:
         print(f"Re-testing {len(bad)} bad proxies...")
-        good2, bad2 = validate_proxies(bad)
+        good2, bad2 = validate_proxies([p["proxy"] for p in bad])
+        for res in good2:
+            pool.report(res["proxy"], True, res["latency"])
         good.extend(good2)
         bad = bad2
     print(f"After 2nd test - Valid proxies: {len(good)}, Invalid proxies: {len(bad)}")
-    save_proxies("valid_proxies.txt", good)
\ No newline at end of file
+    # Failed both tests: keep them out of the saved pool (and the scraper's retry budget)
+    pool.remove([p["proxy"] for p in bad])
+    save_proxies("valid_proxies.txt", sorted(good, key=lambda p: p["latency"]))
+    pool.save(PROXY_POOL_PATH)
@@ -1,6 +1,8 @@
 import pandas as pd
 import transform_stock_code as tsc
-from collections import Counter
+import parquet_store
+from job_store import JobStore, JOB_STORE_PATH
+from coverage_manifest import CoverageManifest
 import os
 
 
@@ -9,45 +11,43 @@ if __name__ == "__main__":
     file_name_list = os.listdir(path)
     stock_code_df = pd.read_csv("hk_stock_list_short.csv", dtype={"股份代號": str}) # whole stock list
     whole_stock_list = stock_code_df['股份代號'].unique().tolist()
-    type_stock = {'zyzb': [], 'zcfzb': [], 'lrb': [], 'xjllb': []}
 
-    with open("fail_stocks.txt", "r") as f:
-        fail_stock_lines = f.readlines()
-    
-    # Parse into dictionary
-    fail_stock_reasons = {}
-    for line in fail_stock_lines:
-        if ':' in line:
-            stock_code, reason = line.strip().split(':', 1)  # split on first ':' only
-            fail_stock_reasons[stock_code.strip()] = reason.strip()
+    # Fail reason codes recorded by the scraper
+    store = JobStore(JOB_STORE_PATH)
+    fail_stock_reasons = store.failed()
+    # Row counts and hashes per (stock, table), kept up to date by the scraper's PartitionWriter
+    manifest = CoverageManifest(JOB_STORE_PATH)
 
-    for file_name in file_name_list:
+    # Re-clean only the files whose content changed since they were last checked
+    for file_name in sorted(file_name_list):
+        file_path = os.path.join(path, file_name)
+        changed, _ = manifest.file_changed(file_path)
+        if not changed:
+            continue
         file_type = file_name.split('_')[0]
-        df = pd.read_csv(os.path.join(path, file_name))
+        is_parquet = file_name.endswith('.parquet')
+        df = parquet_store.read_parquet(file_path) if is_parquet else pd.read_csv(file_path)
         df = tsc.transform_stock_code(df, '股票代码')
         df = df.drop_duplicates()
-        stock_list = df['股票代码'].unique().tolist()
-        type_stock[file_type].extend(stock_list)
-        df.to_csv(os.path.join(path, file_name), index=False)
+        if is_parquet:
+            parquet_store.write_parquet(df, file_path)
+        else:
+            df.to_csv(file_path, index=False)
+        # row counts only: hashes of these compacted frames never match the writer's per-stock ones
+        manifest.record_frame(df, file_type, hashes=False)
+        manifest.record_file(file_path)
         print(f"Cleaning file: {file_name}")
-    
-    # Stocks that are successfully scraped in all 4 types
-    cnt_dic = {}
-    for k, stock_list in type_stock.items():
-        for stock in stock_list:
-            if stock not in cnt_dic:
-                cnt_dic[stock] = [k]
-            else:
-                cnt_dic[stock].append(k)
-    # Failed Stocks
-    failed_stocks = [stock for stock,type_list in cnt_dic.items() if len(type_list) < 4]
+
+    # Stocks scraped in some but not all 4 types
+    failed_stocks = list(manifest.incomplete_stocks())
     print("Failed stocks:", failed_stocks)
 
     re_scrape_stocks = []
     for fs in failed_stocks:
-        if fs in fail_stock_reasons.keys() and fail_stock_reasons[fs] == 'Exceeded maximum retry attempts':
+        if fs in fail_stock_reasons.keys() and fail_stock_reasons[fs] == 'max_retries':
             re_scrape_stocks.append(fs)
         if fs not in fail_stock_reasons.keys():
             re_scrape_stocks.append(fs)
             
     print("Stocks to re-scrape:", re_scrape_stocks)
+    store.requeue(re_scrape_stocks)  # picked up by the next east_money_scraper.py run
@@ -0,0 +1,412 @@
+import argparse
+import ipaddress
+import os
+import socket
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from job_store import JobStore, JobFeed, JOB_STORE_PATH, PENDING, IN_PROGRESS, default_owner
+from proxy_pool import ProxyPool
+
+COORDINATOR_ADDRESS = ("127.0.0.1", 6200)  # bind to 0.0.0.0 to take workers from other hosts
+# Connections exchange pickles, so the key is all that stops anyone who can reach the port from running code on
+# the coordinator or its workers. Set SCRAPER_AUTHKEY to the same secret on every host; the built-in key is only
+# accepted on loopback addresses.
+LOCAL_AUTHKEY = b"east-money-scraper"
+AUTHKEY = os.environ["SCRAPER_AUTHKEY"].encode() if os.environ.get("SCRAPER_AUTHKEY") else LOCAL_AUTHKEY
+HEARTBEAT_SECONDS = 10  # how often workers check in and renew their leases
+HEARTBEAT_TIMEOUT = 60  # a worker silent this long is presumed dead: its stocks and proxies are freed
+SHARD_SIZE = 10  # stocks leased to a worker at a time
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def check_authkey(address, authkey):
+    """Refuse the built-in key (or none) for anything but a loopback address."""
+    if (not authkey or authkey == LOCAL_AUTHKEY) and not is_loopback(address[0]):
+        raise ValueError(f"{address[0]} is not a loopback address: set SCRAPER_AUTHKEY to a secret shared by "
+                         f"the coordinator and its workers")
+
+
+class Coordinator:
+    """
+    Hand out the job store to scraper workers on any number of hosts over one socket.
+
+    Workers register to get a disjoint subset of the proxies, then lease shards of stocks
+    (JobStore.claim_batch with the worker as lease owner), report completions and failures,
+    and send heartbeats that renew their leases. A worker that stops heartbeating for
+    `heartbeat_timeout` seconds has its unfinished stocks returned to pending and its
+    proxies given to the next worker to register. Only the coordinator opens the job store,
+    so no two workers can lease the same stock.
+
+    Messages are (method, worker_id, *args) tuples, replies (ok, result).
+
+    :param store: JobStore holding the jobs
+    :param proxies: Proxies to split between the workers
+    :param proxies_per_worker: Proxies given to each worker (default: an even share for `expected_workers`)
+    """
+
+    def __init__(self, store, proxies, address=COORDINATOR_ADDRESS, authkey=AUTHKEY, proxies_per_worker=None,
+                 expected_workers=4, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self.store = store
+        self.address = address
+        self.authkey = authkey
+        self.proxies_per_worker = proxies_per_worker or max(1, len(proxies) // max(1, expected_workers))
+        self.heartbeat_timeout = heartbeat_timeout
+        self._free_proxies = list(dict.fromkeys(proxies))
+        self._workers = {}  # worker id -> {"host", "proxies", "last_seen", "idle", "stats"}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._listener = None
+        self._threads = []
+        self.handlers = {
+            "register": self.register,
+            "claim": self.claim,
+            "complete": self.complete,
+            "fail": self.fail,
+            "release": self.release,
+            "heartbeat": self.heartbeat,
+            "unregister": self.unregister,
+            "status": lambda worker_id: self.status(),
+        }
+
+    def _seen(self, worker_id):
+        """:return: True if the worker is registered, updating its last heartbeat"""
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is not None:
+                worker["last_seen"] = time.time()
+            return worker is not None
+
+    def register(self, worker_id, host=None):
+        """
+        :return: Proxies assigned to the worker, empty if none are free
+        """
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is None:  # a worker reconnecting keeps its proxies
+                proxies = self._free_proxies[:self.proxies_per_worker]
+                del self._free_proxies[:len(proxies)]
+                worker = self._workers[worker_id] = {"host": host, "proxies": proxies, "idle": False, "stats": {}}
+            worker["last_seen"] = time.time()
+        print(f"Worker {worker_id} registered with {len(worker['proxies'])} proxies.")
+        return worker["proxies"]
+
+    def claim(self, worker_id, n):
+        """
+        :return: Dict of stock code -> table names leased to the worker, empty when there is
+            nothing left or for unknown workers (e.g. one that was presumed dead) so they stop.
+            None when nothing is pending but other workers still hold leases that may come back.
+        """
+        if not self._seen(worker_id):
+            return {}
+        claimed = self.store.claim_batch(worker_id, n)
+        owners = self.store.owners() if not claimed else {}
+        with self._lock:
+            # an idle worker only completes its last stocks when it stops, so don't wait for those
+            busy = [owner for owner in owners
+                    if owner != worker_id and not self._workers.get(owner, {}).get("idle")]
+            if worker_id in self._workers:
+                self._workers[worker_id]["idle"] = bool(busy)
+        return None if busy else claimed
+
+    def complete(self, worker_id, jobs):
+        self._seen(worker_id)
+        self.store.complete(jobs)
+
+    def fail(self, worker_id, stock_code, reason):
+        self._seen(worker_id)
+        self.store.fail(stock_code, reason)
+
+    def release(self, worker_id, stock_codes):
+        self._seen(worker_id)
+        self.store.release(stock_codes)
+
+    def heartbeat(self, worker_id, stats=None):
+        """
+        Renew the worker's leases.
+
+        :return: False if the worker is unknown and should stop
+        """
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is None:
+                return False
+            worker["last_seen"] = time.time()
+            worker["stats"] = stats or {}
+        self.store.renew(worker_id)
+        return True
+
+    def unregister(self, worker_id):
+        """Release the worker's unfinished stocks and free its proxies."""
+        with self._lock:
+            worker = self._workers.pop(worker_id, None)
+            if worker is not None:
+                self._free_proxies.extend(worker["proxies"])
+        released = self.store.release_owner(worker_id)
+        if worker is not None:
+            print(f"Worker {worker_id} left" + (f", released {released} jobs." if released else "."))
+
+    def status(self):
+        """
+        :return: Dict with the job counts and, per worker, its host, proxy count, whether it
+            waits for stocks, seconds since its last heartbeat and last reported stats
+        """
+        now = time.time()
+        with self._lock:
+            workers = {worker_id: {"host": w["host"], "proxies": len(w["proxies"]), "waiting": w["idle"],
+                                   "silent": round(now - w["last_seen"], 1), **w["stats"]}
+                       for worker_id, w in self._workers.items()}
+        return {"jobs": self.store.counts(), "workers": workers}
+
+    def done(self):
+        """:return: True once no jobs are pending or leased and every worker has left"""
+        counts = self.store.counts()
+        with self._lock:
+            return not self._workers and not counts.get(PENDING) and not counts.get(IN_PROGRESS)
+
+    def reap(self):
+        """Unregister workers whose last heartbeat is older than `heartbeat_timeout`."""
+        cutoff = time.time() - self.heartbeat_timeout
+        with self._lock:
+            dead = [worker_id for worker_id, w in self._workers.items() if w["last_seen"] < cutoff]
+        for worker_id in dead:
+            print(f"Worker {worker_id} missed its heartbeats.")
+            self.unregister(worker_id)
+
+    def _handle(self, conn):
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    method, worker_id, *args = conn.recv()
+                except (EOFError, OSError):
+                    return  # the worker's leases stay until it unregisters or times out
+                try:
+                    conn.send((True, self.handlers[method](worker_id, *args)))
+                except Exception as e:
+                    conn.send((False, f"{type(e).__name__}: {e}"))
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                if not self._stop.is_set():
+                    print(f"[!] Rejected connection: {type(e).__name__}: {e}")
+                continue
+            if self._stop.is_set():
+                conn.close()
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.heartbeat_timeout / 4):
+            self.reap()
+
+    def start(self):
+        check_authkey(self.address, self.authkey)
+        self._listener = Listener(self.address, authkey=self.authkey)
+        self.address = self._listener.address  # the actual port when 0 was given
+        self._threads = [threading.Thread(target=self._serve, name="coordinator", daemon=True),
+                         threading.Thread(target=self._reap_loop, name="coordinator-reaper", daemon=True)]
+        for t in self._threads:
+            t.start()
+        print(f"Coordinator listening on {self.address[0]}:{self.address[1]}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        try:  # wake up accept()
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+        for t in self._threads:
+            t.join()
+        self._listener.close()
+
+
+class CoordinatorClient:
+    """
+    A worker's connection to the Coordinator. Stands in for the JobStore in JobFeed,
+    east_money_scraper.run_scraper and PartitionWriter(on_flush=client.complete).
+
+    After `register`, a background thread heartbeats every `heartbeat_seconds`, which
+    keeps this worker's leases alive while it scrapes.
+    """
+
+    def __init__(self, address=COORDINATOR_ADDRESS, authkey=AUTHKEY, worker_id=None,
+                 heartbeat_seconds=HEARTBEAT_SECONDS):
+        self.worker_id = worker_id or default_owner()
+        self.heartbeat_seconds = heartbeat_seconds
+        self.proxies = []
+        self.completed = 0  # tables
+        self.failed = 0  # stocks
+        self.lost = False  # the coordinator presumed this worker dead
+        check_authkey(address, authkey)
+        self._conn = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _call(self, method, *args):
+        with self._lock:
+            self._conn.send((method, self.worker_id) + args)
+            ok, result = self._conn.recv()
+        if not ok:
+            raise RuntimeError(f"Coordinator {method} failed: {result}")
+        return result
+
+    def register(self):
+        """
+        :return: Proxies assigned to this worker
+        """
+        self.proxies = self._call("register", socket.gethostname())
+        self._thread = threading.Thread(target=self._heartbeat, name="coordinator-heartbeat", daemon=True)
+        self._thread.start()
+        return self.proxies
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                if not self._call("heartbeat", {"completed": self.completed, "failed": self.failed}):
+                    print("[!] Coordinator no longer knows this worker, no more stocks will be claimed.")
+                    self.lost = True
+                    return
+            except Exception as e:  # keep heartbeating, or the coordinator reaps a healthy worker
+                print(f"[!] Heartbeat failed: {type(e).__name__}: {e}")
+
+    def claim_batch(self, owner, n):
+        """
+        Lease up to `n` stocks; the coordinator uses this worker's id as the lease owner.
+        While other workers still hold stocks, waits for them rather than stopping, so the
+        stocks of a worker that dies are picked up.
+        """
+        while not self.lost:
+            claimed = self._call("claim", n)
+            if claimed is not None:
+                return claimed
+            self._stop.wait(self.heartbeat_seconds)
+        return {}
+
+    def renew(self, owner):
+        """Leases are renewed by the heartbeats; nothing to do for JobFeed.keep_alive."""
+        return 0
+
+    def complete(self, jobs):
+        jobs = list(jobs)
+        self._call("complete", jobs)
+        self.completed += len(jobs)
+
+    def fail(self, stock_code, reason):
+        self._call("fail", stock_code, reason)
+        self.failed += 1
+
+    def release(self, stock_codes):
+        self._call("release", list(stock_codes))
+
+    def status(self):
+        return self._call("status")
+
+    def close(self):
+        """Stop heartbeating and unregister, releasing any stocks still leased."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self._call("unregister")
+        except (OSError, EOFError):
+            pass
+        self._conn.close()
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or COORDINATOR_ADDRESS[0], int(port)
+
+
+def serve(args):
+    import pandas as pd
+    from east_money_scraper import prepare_jobs
+
+    store = JobStore(args.db)
+    stock_list = pd.read_csv(args.stock_list, dtype={"股份代號": str})["股份代號"].tolist()
+    prepare_jobs(store, stock_list)
+    recovered = store.recover()  # no worker is connected yet: in-progress jobs were left by a crash
+    if recovered:
+        print(f"Recovered {recovered} unfinished jobs from the previous run.")
+    print("Jobs:", store.counts())
+    proxies = ProxyPool.load(args.proxies).proxies
+    coordinator = Coordinator(store, proxies, parse_address(args.address), proxies_per_worker=args.proxies_per_worker,
+                              expected_workers=args.workers).start()
+    try:
+        while not (args.exit_when_done and coordinator.done()):
+            time.sleep(HEARTBEAT_SECONDS)
+            print("Status:", coordinator.status())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        coordinator.stop()
+    print("Jobs:", store.counts())
+    store.close()
+
+
+def work(args):
+    import east_money_scraper as ems
+    from coverage_manifest import CoverageManifest
+    from partition_writer import PartitionWriter
+
+    client = CoordinatorClient(parse_address(args.coordinator))
+    proxies = client.register()
+    if not proxies:
+        print("No free proxies on the coordinator, not scraping.")
+        client.close()
+        return
+    if args.replay:  # the assigned proxy names are only slots, every request goes to the stub directly
+        fetcher_factory = lambda slot: ems.PageReplayFetcher(args.replay)
+    else:
+        fetcher_factory = ems.make_fetcher
+    feed = JobFeed(client, owner=client.worker_id, batch_size=SHARD_SIZE, limit=args.limit)
+    # Partitions are written on this host; the manifest (coverage only) lives in its local job store file
+    writer = PartitionWriter(on_flush=client.complete, manifest=CoverageManifest(JOB_STORE_PATH),
+                             storage_format=ems.STORAGE_FORMAT)
+    try:
+        success_stocks, fail_stocks, limiter = ems.run_scraper(client, feed, ProxyPool(proxies), writer,
+                                                               fetcher_factory, num_workers=args.workers)
+    finally:
+        client.close()
+    print(f"Worker {client.worker_id} done. Successful stocks: {len(success_stocks)}, "
+          f"Failed stocks: {len(fail_stocks)}, Unchanged tables: {writer.unchanged}")
+    print(limiter.summary())
+
+
+if __name__ == "__main__":
+    # One coordinator:  SCRAPER_AUTHKEY=<secret> python coordinator.py serve --address 0.0.0.0:6200
+    # Workers anywhere: SCRAPER_AUTHKEY=<secret> python coordinator.py work --coordinator <host>:6200
+    parser = argparse.ArgumentParser(description="Scrape with several worker processes or hosts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("serve", help="run the coordinator")
+    p.add_argument("--address", default="%s:%d" % COORDINATOR_ADDRESS)
+    p.add_argument("--db", default=JOB_STORE_PATH)
+    p.add_argument("--stock-list", default="hk_stock_list_short.csv")
+    p.add_argument("--proxies", default="valid_proxies.txt", help="proxy list or scored proxy_pool.json")
+    p.add_argument("--workers", type=int, default=4, help="expected workers, to split the proxies evenly")
+    p.add_argument("--proxies-per-worker", type=int)
+    p.add_argument("--exit-when-done", action="store_true")
+    p = commands.add_parser("work", help="run a worker")
+    p.add_argument("--coordinator", default="%s:%d" % COORDINATOR_ADDRESS)
+    p.add_argument("--workers", type=int, default=4, help="parallel fetchers in this worker")
+    p.add_argument("--limit", type=int, help="stop after this many stocks")
+    p.add_argument("--replay", metavar="PAGE_URL",
+                   help="read the F10 pages recorded on this stub_server URL without a browser or proxies")
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+    else:
+        work(args)
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from job_store import JOB_STORE_PATH
+from partition_writer import TABLE_NAMES, hash_frame
+
+
+def hash_file(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CoverageManifest:
+    """
+    Which (stock, table) pairs have data, with row counts and content hashes,
+    plus a hash per finance_data file so unchanged files are not re-cleaned.
+
+    Stored next to the job store in the same SQLite file.
+    """
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS coverage (
+                stock_code TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                updated_at REAL,
+                PRIMARY KEY (stock_code, table_name)
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                content_hash TEXT NOT NULL,
+                updated_at REAL
+            );
+        """)
+
+    def record(self, entries):
+        """
+        :param entries: Iterable of (stock_code, table_name, row_count, content_hash)
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO coverage (stock_code, table_name, row_count, content_hash, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(s, t, int(n), h, now) for s, t, n, h in entries])
+
+    def record_counts(self, entries):
+        """
+        Update row counts only, keeping the content hashes PartitionWriter compares against.
+
+        :param entries: Iterable of (stock_code, table_name, row_count)
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO coverage (stock_code, table_name, row_count, content_hash, updated_at) "
+                "VALUES (?, ?, ?, '', ?) ON CONFLICT (stock_code, table_name) "
+                "DO UPDATE SET row_count = excluded.row_count, updated_at = excluded.updated_at",
+                [(s, t, int(n), now) for s, t, n in entries])
+
+    def record_frame(self, df, table_name, stock_col='股票代码', hashes=True):
+        """
+        Record coverage for every stock in a frame holding one table type.
+
+        :param hashes: Also record content hashes; only for frames as PartitionWriter writes them,
+            since the writer skips a table whose hash matches
+        """
+        groups = df.groupby(stock_col, sort=False)
+        if hashes:
+            self.record((stock_code, table_name, len(group), hash_frame(group)) for stock_code, group in groups)
+        else:
+            self.record_counts((stock_code, table_name, len(group)) for stock_code, group in groups)
+
+    def content_hash(self, stock_code, table_name):
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash FROM coverage WHERE stock_code = ? AND table_name = ?",
+                                     (stock_code, table_name)).fetchone()
+        return row[0] if row else None
+
+    def tables_for(self, stock_code):
+        """
+        :return: Dict of table name -> row count scraped for one stock
+        """
+        with self._lock:
+            return dict(self._conn.execute("SELECT table_name, row_count FROM coverage WHERE stock_code = ?",
+                                           (stock_code,)).fetchall())
+
+    def is_complete(self, stock_code, table_names=TABLE_NAMES):
+        tables = self.tables_for(stock_code)
+        return all(tables.get(t, 0) > 0 for t in table_names)
+
+    def incomplete_stocks(self, table_names=TABLE_NAMES):
+        """
+        :return: Dict of stock code -> list of tables it has, for stocks with some but not all tables
+        """
+        placeholders = ",".join("?" * len(table_names))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT stock_code, GROUP_CONCAT(table_name) FROM coverage "
+                f"WHERE row_count > 0 AND table_name IN ({placeholders}) GROUP BY stock_code "
+                f"HAVING COUNT(*) < ?", (*table_names, len(table_names))).fetchall()
+        return {stock_code: tables.split(",") for stock_code, tables in rows}
+
+    def file_changed(self, path):
+        """
+        True if `path` differs from when it was last recorded; size and mtime are
+        checked first so unchanged files are not read.
+
+        :return: (changed, content_hash)
+        """
+        stat = os.stat(path)
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime, content_hash FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return False, row[2]
+        content_hash = hash_file(path)
+        return (row is None or row[2] != content_hash), content_hash
+
+    def record_file(self, path, content_hash=None):
+        stat = os.stat(path)
+        content_hash = content_hash or hash_file(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, content_hash, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime, content_hash, time.time()))
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+
+def on_uniques(values, fn):
+    """
+    Apply a Series -> Series conversion to the distinct values only and broadcast it back.
+    Report dates and fiscal year ends repeat on every item row, so this is most of the work saved.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    converted = fn(pd.Series(uniques))
+    return pd.Series(converted.array.take(codes), index=values.index, name=values.name)
+
+
+def report_dates(values):
+    """'YY-MM-DD' page dates (or datetime64 from Parquet) as date objects."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.date
+    return on_uniques(values, lambda u: pd.to_datetime('20' + u.astype(str), errors='coerce').dt.date)
+
+
+def report_month(dates):
+    return on_uniques(dates, lambda u: pd.to_datetime(u).dt.month.astype(pd.Int64Dtype()))
+
+
+def year_end_month(fiscal_year_ends):
+    """Month of a 年结日 such as '12-31'."""
+    return on_uniques(fiscal_year_ends, lambda u: u.astype(str).str.split('-').str[0].astype(pd.Int64Dtype()))
+
+
+def order_index(df):
+    """Position of each row's (指标组, 指标名称) in first-appearance order."""
+    return df.groupby(['指标组', '指标名称'], sort=False, dropna=False).ngroup()
+
+
+def date_table(df):
+    """
+    Latest report date and fiscal year end month(s) per stock (stock_date_df).
+
+    :param df: Rows with 股票代码, 报表截止日 and 年结月 (or 年结日)
+    """
+    year_end = df['年结月'] if '年结月' in df.columns else year_end_month(df['年结日'])
+    fiscal = pd.DataFrame({'股票代码': df['股票代码'], '年结月': year_end}).drop_duplicates()
+    latest = df.groupby('股票代码')['报表截止日'].max().reset_index()
+    date_df = pd.merge(latest, fiscal, on='股票代码', how='left')  # one row per stock and fiscal year end
+    return date_df.rename(columns={'报表截止日': '最新报表截止日'})
+
+
+def _sort_key(values, descending=False):
+    """Integer sort key ordering like sort_values, missing values last."""
+    codes, uniques = pd.factorize(values, sort=True)
+    if descending:
+        codes = np.where(codes < 0, -1, len(uniques) - 1 - codes)
+    return np.where(codes < 0, len(uniques), codes)
+
+
+def select_reports(df, file_type, date_df, stock_df):
+    """
+    Flag each row's latest report (是否最新报表) and, for zyzb, annual report (是否年报),
+    keep the latest and annual reports of listed stocks, drop duplicate rows and sort by
+    stock, report date (newest first) and order_index.
+
+    Lookups into date_df and stock_df are Series maps on the stock code instead of merges,
+    so the frame is never copied wider than it is; columns are added to `df` in place.
+    A stock with several fiscal year ends in date_df (zyzb), or listed twice in stock_df,
+    falls back to the merge, which repeats its rows once per match.
+
+    :return: Selected rows with every column of `df` plus the flags and 股份簡稱
+    """
+    stock = df['股票代码']
+    if file_type == 'zyzb' and not date_df['股票代码'].is_unique:
+        df = pd.merge(df, date_df, on='股票代码', how='left')
+        stock = df['股票代码']
+    else:
+        by_stock = date_df.drop_duplicates('股票代码').set_index('股票代码')
+        df['最新报表截止日'] = stock.map(by_stock['最新报表截止日'])
+        if file_type == 'zyzb':
+            df['年结月'] = stock.map(by_stock['年结月']).astype(pd.Int64Dtype())
+    if file_type == 'zyzb':
+        df['是否年报'] = np.where(df['报表月'] == df['年结月'], 1, 0)
+    df['是否最新报表'] = np.where(df['报表截止日'] == df['最新报表截止日'], 1, 0)
+
+    keep = (df['是否最新报表'].to_numpy() == 1) | (df['是否年报'].to_numpy() == 1)
+    if stock_df['股份代號'].is_unique:
+        names = stock_df.set_index('股份代號')
+        keep &= stock.isin(names.index).to_numpy()
+        out = df.loc[keep].copy()
+        for col in names.columns:
+            out[col] = out['股票代码'].map(names[col])
+        out['股份代號'] = out['股票代码']
+    else:
+        out = pd.merge(df.loc[keep], stock_df, left_on='股票代码', right_on='股份代號')
+
+    out = out.loc[~out.duplicated()]
+    order = np.lexsort((_sort_key(out['order_index']),
+                        _sort_key(out['报表截止日'], descending=True),
+                        _sort_key(out['股票代码'])))
+    return out.iloc[order]
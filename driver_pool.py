@@ -0,0 +1,167 @@
+import itertools
+import threading
+import time
+from functools import lru_cache
+
+from webdriver_manager.chrome import ChromeDriverManager
+
+from metrics import metrics
+
+
+@lru_cache(maxsize=None)
+def get_driver_path():
+    """
+    Resolve the chromedriver binary once per process.
+
+    :return: Path to the chromedriver executable
+    """
+    return ChromeDriverManager().install()
+
+
+class PooledDriver:
+    """
+    A long-lived driver slot owned by one worker thread.
+
+    The driver is created lazily with a proxy chosen by the proxy pool and is
+    recycled after `max_pages` pages or after any error.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.driver = None
+        self.proxy = None
+        self.pages = 0
+
+    def get(self):
+        attempts = 0
+        while self.driver is None:
+            if attempts >= len(self.pool.proxy_pool):
+                raise RuntimeError("Could not create a driver with any proxy")
+            proxy = self.pool.proxy_pool.choose()
+            attempts += 1
+            try:
+                self.driver = self.pool.make_driver(proxy)
+            except Exception as e:
+                print(f"Error creating driver with proxy {proxy}: {e}")
+                self.pool.proxy_pool.report(proxy, False)
+                metrics.incr("proxy_failures", proxy=proxy, stage="create")
+                continue
+            self.proxy = proxy
+            self.pages = 0
+        return self.driver
+
+    def release(self, failed=False, latency=None):
+        self.pool.proxy_pool.report(self.proxy, not failed, latency)
+        if failed:
+            metrics.incr("proxy_failures", proxy=self.proxy, stage="scrape")
+        elif latency is not None:
+            metrics.observe("proxy_latency_seconds", latency, proxy=self.proxy)
+        self.pages += 1
+        if failed or self.pages >= self.pool.max_pages:
+            self.recycle()
+
+    def recycle(self):
+        if self.driver is not None:
+            metrics.incr("driver_recycles")
+            try:
+                self.driver.quit()
+            except Exception as e:
+                print(f"Error quitting driver with proxy {self.proxy}: {e}")
+        self.driver = None
+        self.proxy = None
+        self.pages = 0
+
+
+class DriverPool:
+    """
+    Run a stock queue through `size` parallel workers, each holding one driver.
+
+    :param proxy_pool: ProxyPool the workers draw proxies from and report outcomes to
+    :param make_driver: Callable creating a driver for a proxy; the driver must have `quit()`
+    :param size: Number of parallel workers
+    :param max_pages: Recycle a driver after this many pages
+    :param max_tries: Attempts per stock before giving up (default: one per healthy proxy)
+    :param limiter: rate_limiter.RateLimiter pacing requests per proxy and overall, None to not wait
+    """
+
+    def __init__(self, proxy_pool, make_driver, size=4, max_pages=50, max_tries=None, limiter=None):
+        self.proxy_pool = proxy_pool
+        self.make_driver = make_driver
+        self.size = max(1, min(size, len(proxy_pool)))
+        self.max_pages = max_pages
+        self.max_tries = max_tries or max(1, len(proxy_pool.healthy()))  # dead proxies add no useful tries
+        self.limiter = limiter
+
+    def run(self, stocks, scrape_fn, on_result, on_fail):
+        """
+        Scrape every stock in `stocks`.
+
+        :param stocks: List or iterator of stock codes (e.g. a job_store.JobFeed)
+        :param scrape_fn: Callable (driver, stock_code) -> result, raising on failure
+        :param on_result: Callable (stock_code, result), called from worker threads
+        :param on_fail: Callable (stock_code, fail_reason), called from worker threads
+        """
+        total = len(stocks) if hasattr(stocks, "__len__") else "?"
+        stock_iter = zip(itertools.count(), iter(stocks))
+        lock = threading.Lock()
+
+        def next_stock():
+            with lock:
+                return next(stock_iter, None)
+
+        workers = [
+            threading.Thread(target=self._worker, args=(next_stock, total, scrape_fn, on_result, on_fail),
+                             name=f"driver-worker-{n}")
+            for n in range(self.size)
+        ]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+    def _worker(self, next_stock, total, scrape_fn, on_result, on_fail):
+        slot = PooledDriver(self)
+        try:
+            while True:
+                item = next_stock()
+                if item is None:
+                    return
+                i, stock_code = item
+                self._scrape_with_retries(slot, i, total, stock_code, scrape_fn, on_result, on_fail)
+        finally:
+            slot.recycle()
+
+    def _scrape_with_retries(self, slot, i, total, stock_code, scrape_fn, on_result, on_fail):
+        for try_times in range(1, self.max_tries + 1):
+            try:
+                driver = slot.get()
+            except RuntimeError as e:
+                print(f"[!!!] {stock_code}: {e}")
+                continue
+            proxy = slot.proxy
+            if self.limiter is not None:
+                with metrics.timer("rate_limit_wait"):
+                    self.limiter.acquire(proxy)
+
+            if try_times > 1:
+                metrics.incr("retries")
+            print(f">>>>>Scraping stock {i+1}/{total}: {stock_code}, try_times: {try_times}, using proxy: {slot.proxy}")
+            start = time.time()
+            try:
+                result = scrape_fn(driver, stock_code)
+            except Exception as e:
+                print(f"[!!!] Error loading page for {stock_code}: {e}")
+                slot.release(failed=True)
+                if self.limiter is not None:
+                    backoff = self.limiter.failure(proxy)
+                    metrics.incr("backoffs")
+                    print(f"Backing off proxy {proxy} for {backoff:.1f}s")
+                continue
+            slot.release(latency=time.time() - start)
+            if self.limiter is not None:
+                self.limiter.success(proxy)
+            on_result(stock_code, result)
+            return
+
+        print(f"{stock_code}: Exceeded maximum retry attempts. try next stock.")
+        on_fail(stock_code, "Exceeded maximum retry attempts")
@@ -2,15 +2,98 @@ from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 import pandas as pd
+import lxml.html
+import requests
 from io import StringIO
+from pandas.io.parsers import TextParser
 import transform_data_for_scraper as tdfs
+import threading
 import time
-import random
+import os
+import re
+from driver_pool import DriverPool, get_driver_path
+from pipeline import Pipeline
+from partition_writer import PartitionWriter
+from proxy_pool import ProxyPool, PROXY_POOL_PATH
+from rate_limiter import RateLimiter
+from job_store import JobStore, JobFeed, JOB_STORE_PATH, REASON_CODES
+from coverage_manifest import CoverageManifest
+import report_calendar
+from metrics import metrics, METRICS_PATH
+from stub_server import F10_PATH, save_page
+
+NUM_WORKERS = 4  # parallel drivers
+PARSE_WORKERS = 2  # processes parsing and transforming fetched pages, 0 to do it in the fetch threads
+MAX_PAGES_PER_DRIVER = 50  # recycle a driver after this many pages
+PROXY_REVALIDATE_SECONDS = 600  # background proxy health check interval
+CLAIM_BATCH_SIZE = 10  # stocks leased from the job store at a time
+MAX_STOCKS_PER_RUN = 200  # None to scrape every pending stock
+STORAGE_FORMAT = "csv"  # "csv" or "parquet" (needs pyarrow) for the partitions
+METRICS_ENABLED = True  # stage timers, counters and per-proxy latency; near-free when off
+METRICS_PORT = None  # e.g. 9108 to serve Prometheus text on http://127.0.0.1:9108/metrics
+F10_URL = "https://emweb.securities.eastmoney.com" + F10_PATH  # or a stub_server URL to replay recorded pages
+RECORD_DIR = None  # e.g. "fixtures" to save every page the browser reads as a stub_server fixture
+content_list = ["content_zyzb", "content_zcfzb", "content_lrb", "content_xjllb"]
+BATCH_EXTRACT = True  # BrowserFetcher: one wait and one execute_script for all tables instead of per-table read_html
+TABLE_WAIT_SECONDS = 15  # shared by all tables in batch mode
+TABLE_SETTLE_SECONDS = 3  # once a table is in, wait this much longer for the rest before giving up
+
+# Page state, unit and the cells of every table in content_list, in one round trip.
+# arguments: content names, whether to return the tables found so far while still loading.
+# Cells are [text, rowspan, colspan, is_th]; rows and cells follow pd.read_html (lxml flavor):
+# thead, tbody and tfoot rows, and no text from elements styled display:none.
+EXTRACT_TABLES_JS = r"""
+const [names, partial] = arguments;
+if (!document.body) return null;
+const page = document.body.textContent;
+if (page.includes('基金概况') && page.includes('基金代码')) return {status: 'fund'};
+if (document.querySelector('div.empty')) return {status: 'empty'};
+
+const hidden = el => (el.getAttribute('style') || '').replace(/ /g, '').includes('display:none');
+const shown = (el, table) => {
+  for (; el && el !== table; el = el.parentElement) if (hidden(el)) return false;
+  return !hidden(table);
+};
+const text = node => {
+  if (node.nodeType === Node.TEXT_NODE) return node.nodeValue;
+  if (node.nodeType !== Node.ELEMENT_NODE || node.tagName === 'STYLE' || hidden(node)) return '';
+  if (node.tagName === 'BR') return '\n';
+  let s = '';
+  for (const child of node.childNodes) s += text(child);
+  return s;
+};
+const rows = (table, selector) => Array.from(table.querySelectorAll(selector))
+  .filter(tr => shown(tr, table))
+  .map(tr => Array.from(tr.children)
+    .filter(td => (td.tagName === 'TD' || td.tagName === 'TH') && !hidden(td))
+    .map(td => [text(td), td.rowSpan, td.colSpan, td.tagName === 'TH']));
+
+const found = {};
+for (const name of names) {
+  const table = document.querySelector(`div.content.${name} table.commonTable`);
+  if (table && table.querySelector('tbody tr')) found[name] = table;
+}
+const missing = names.filter(name => !(name in found));
+const unitNode = document.evaluate("//*[contains(text(), '币种：')]", document, null,
+                                   XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+const unit = unitNode ? unitNode.innerText : null;
+const status = missing.length === 0 && unit !== null ? 'ready' : 'loading';
+if (status === 'loading' && !partial) {
+  window.scrollBy(0, window.innerHeight / 2);  // tables further down may load on scroll
+  return {status, missing, unit};
+}
+const tables = {};
+for (const [name, table] of Object.entries(found)) {
+  tables[name] = {head: rows(table, 'thead > tr'), body: rows(table, 'tbody tr'), foot: rows(table, 'tfoot tr')};
+}
+return {status, missing, unit, tables};
+"""
+_RE_WHITESPACE = re.compile(r"[\r\n]+|\s{2,}")  # as pd.read_html collapses cell text
+
 
 def make_driver_without_proxy():
     options = Options()
@@ -18,35 +101,42 @@ def make_driver_without_proxy():
     options.add_argument("user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
                         "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/143.0.0.0 Safari/537.36")
     options.add_argument("--lang=zh-CN")
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    with metrics.timer("chrome_start"):
+        driver = webdriver.Chrome(service=Service(get_driver_path()), options=options)
     return driver
 
 
 def make_driver_with_proxy(proxy):
     options = Options()
-    options.add_argument(f'--proxy-server=http://{proxy}')
+    if proxy:
+        options.add_argument(f'--proxy-server=http://{proxy}')
     options.add_argument("--headless=new")  # headless mode
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    with metrics.timer("chrome_start"):
+        driver = webdriver.Chrome(service=Service(get_driver_path()), options=options)
     return driver
 
 
 def open_url(driver, stock_code):
-    url = f"https://emweb.securities.eastmoney.com/PC_HKF10/pages/home/index.html?code={stock_code}&type=web&color=w#/NewFinancialAnalysis"
-    driver.get(url)
+    url = f"{F10_URL}?code={stock_code}&type=web&color=w#/NewFinancialAnalysis"
+    with metrics.timer("driver_get"):
+        driver.get(url)
 
 
-def get_finance_table(driver, wait, content_name="content_zyzb"):
+def get_table_html(driver, wait, content_name="content_zyzb"):
+    """
+    :return: outerHTML of the table under `content_name`, None if it did not load
+    """
     try:
-        # Wait for the table element to exist in the DOM
-        container = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, f"div.content.{content_name}")))
-        # Optionally ensure at least one row is present (helps with AJAX-loaded tables)
-        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, f"table.commonTable tbody tr")))
+        with metrics.timer("wait_table"):
+            # Wait for the table element to exist in the DOM
+            container = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, f"div.content.{content_name}")))
+            # Optionally ensure at least one row is present (helps with AJAX-loaded tables)
+            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, f"table.commonTable tbody tr")))
         table = container.find_element(By.CSS_SELECTOR, "table.commonTable")
-        html = table.get_attribute("outerHTML")
-        df = pd.read_html(StringIO(html))[0]
-        return df
+        return table.get_attribute("outerHTML")
     except TimeoutException:
         print(f"Timed out: table under container '{content_name}' not found or no rows present.")
+        metrics.incr("timeouts", stage="wait_table")
         return None
     except Exception as e:
         print(f"Error retrieving table for '{content_name}': {type(e).__name__}: {e}")
@@ -57,11 +147,13 @@ def get_finance_table(driver, wait, content_name="content_zyzb"):
 
 def get_unit(driver, wait):
     try:
-        unit_element = wait.until(EC.presence_of_element_located((By.XPATH, "//*[contains(text(), '币种：')]")))
+        with metrics.timer("wait_unit"):
+            unit_element = wait.until(EC.presence_of_element_located((By.XPATH, "//*[contains(text(), '币种：')]")))
         unit_text = unit_element.text
         return unit_text
     except TimeoutException:
         print("Timed out: unit element not found.")
+        metrics.incr("timeouts", stage="wait_unit")
         return None
     except Exception as e:
         print(f"Error retrieving unit: {type(e).__name__}: {e}")
@@ -78,138 +170,407 @@ def clean_df(df):
     return df2
 
 
-def write_fail_stocks(fail_stocks):
-    with open("fail_stocks.txt", "w") as f:
-        for s in fail_stocks:
-            f.write(s + "\n")
+def expand_spans(rows):
+    """
+    Turn rows of extracted [text, rowspan, colspan, is_th] cells into rows of text,
+    copying spanned cells the way pd.read_html does.
+    """
+    all_texts = []
+    remainder = []  # (index, text, rows left) of cells spanning down
+    for row in rows:
+        texts = []
+        next_remainder = []
+        index = 0
+        for text, rowspan, colspan, _ in row:
+            while remainder and remainder[0][0] <= index:
+                prev_i, prev_text, prev_rowspan = remainder.pop(0)
+                texts.append(prev_text)
+                if prev_rowspan > 1:
+                    next_remainder.append((prev_i, prev_text, prev_rowspan - 1))
+                index += 1
+            text = _RE_WHITESPACE.sub(" ", text.strip())
+            for _ in range(colspan):
+                texts.append(text)
+                if rowspan > 1:
+                    next_remainder.append((index, text, rowspan - 1))
+                index += 1
+        for prev_i, prev_text, prev_rowspan in remainder:
+            texts.append(prev_text)
+            if prev_rowspan > 1:
+                next_remainder.append((prev_i, prev_text, prev_rowspan - 1))
+        all_texts.append(texts)
+        remainder = next_remainder
+    while remainder:  # rows only made of cells spanning down from above
+        all_texts.append([text for _, text, _ in remainder])
+        remainder = [(i, text, n - 1) for i, text, n in remainder if n > 1]
+    return all_texts
 
-def append_fail_stocks(fail_stocks, stock_code, fail_reason):
-    fail_stocks.append(stock_code)
-    with open("fail_stocks.txt", "a") as f:
-        f.write(f"{stock_code}: {fail_reason}\n")
 
+def table_frame(table):
+    """
+    Build the DataFrame pd.read_html would return for an extracted table, without
+    serializing and re-parsing its HTML.
 
-# Load proxies
-with open("valid_proxies.txt", "r") as f:
-        proxies_list = [line.strip() for line in f if line.strip()]
+    :param table: Dict of head, body and foot rows from EXTRACT_TABLES_JS
+    """
+    head, body = list(table["head"]), list(table["body"])
+    if not head:
+        # no <thead>: leading all-<th> rows are the header
+        while body and all(cell[3] for cell in body[0]):
+            head.append(body.pop(0))
+    head = expand_spans(head)
+    body = expand_spans(body) + expand_spans(table["foot"])
+    header = None
+    if head:
+        body = head + body
+        header = 0 if len(head) == 1 else [i for i, row in enumerate(head) if any(row)]
+    width = max(len(row) for row in body)
+    body = [row + [""] * (width - len(row)) for row in body]
+    with TextParser(body, header=header, thousands=",") as parser:
+        return parser.read()
 
-# Load stock codes
-stock_code_df = pd.read_csv("hk_stock_list_short.csv", dtype={"股份代號": str}) # whole stock list
-last_stock = '08426'  # last scraped stock code
-last_index = stock_code_df.loc[stock_code_df['股份代號'] == last_stock].index[0]
-print(len(stock_code_df) - last_index - 1, "stocks remaining to scrape.")
-stock_code_df = stock_code_df.iloc[last_index + 1: last_index + 201] # resume from next stock
-stock_code_list = stock_code_df["股份代號"].tolist()
 
-# Re-Scrape Code
-# stock_code_list = ['01959', '01789', '01285', '01993', 
-#                    '01962', '01948', '02016', '01973', '02023']
-# stock_code_list = ['00798', '01218', '01905', '03399']
+def wait_for_tables(driver, timeout=TABLE_WAIT_SECONDS, settle=TABLE_SETTLE_SECONDS):
+    """
+    Wait once for the unit and every table in content_list, checking all of them with
+    one execute_script per poll.
 
-# Prepare data storage
-content_list = ["content_zyzb", "content_zcfzb", "content_lrb", "content_xjllb"]
-df_dict = {}
-for c in content_list:
-    try:
-        df_existing = pd.read_csv(f"{c.split('_')[-1]}_data.csv")
-        df_dict[c] = [df_existing]
-    except FileNotFoundError:
-        df_dict[c] = []
-
-# Start scraping
-success_stocks = []
-fail_stocks = []
-try_times = 1
-stock_idx = 0
-use_proxy_index = 0
-
-
-# Main scraping loop
-while stock_idx < len(stock_code_list):
-    stock_code = stock_code_list[stock_idx]
-
-    # Check if exceeded max retries
-    if try_times > len(proxies_list):
-        print(f"{stock_code}: Exceeded maximum retry attempts. try next stock.")
-        append_fail_stocks(fail_stocks, stock_code, "Exceeded maximum retry attempts")
-        stock_idx += 1
-        try_times = 1
-        continue
-    
-    # Wait a random time before each request
-    random_number = random.randint(1, 5)
-    time.sleep(random_number)
-    
-    # Set up driver with/without proxy
-    proxy = proxies_list[use_proxy_index]
-    try:
-        driver = make_driver_with_proxy(proxy) # Scape with proxy
-        # driver = make_driver_without_proxy() # Scrape without proxy
-    except Exception as e:
-        print(f"Error creating driver with proxy {proxy}: {e}")
-        use_proxy_index += 1
-        if use_proxy_index >= len(proxies_list):
-            use_proxy_index = 0
-        continue
-    wait = WebDriverWait(driver, 15)  # increase timeout for slow pages
+    Returns as soon as everything is in, the page turns out to be a fund or empty page,
+    or `settle` seconds after the first table showed up, so missing tables cost one short
+    wait instead of a full timeout each.
 
-    print(f">>>>>Scraping stock {stock_idx+1}/{len(stock_code_list)}: {stock_code}, try_times: {try_times}， using proxy: {proxy}")
+    :return: EXTRACT_TABLES_JS result: status, missing, unit and tables
+    """
+    first_table = []
+
+    def loaded(d):
+        result = d.execute_script(EXTRACT_TABLES_JS, content_list, False)
+        if result is None or result["status"] != "loading":
+            return result
+        if len(result["missing"]) < len(content_list):
+            if not first_table:
+                first_table.append(time.monotonic())
+            elif time.monotonic() - first_table[0] >= settle:
+                return d.execute_script(EXTRACT_TABLES_JS, content_list, True)
+        return None
 
-    # Start scraping
     try:
+        with metrics.timer("wait_tables"):
+            return WebDriverWait(driver, timeout, poll_frequency=0.2).until(loaded)
+    except TimeoutException:
+        metrics.incr("timeouts", stage="wait_tables")
+        return driver.execute_script(EXTRACT_TABLES_JS, content_list, True)
+
+
+class BrowserFetcher:
+    """
+    Selenium fetch backend: render the F10 page and read the tables from the DOM.
+
+    :param batch: Wait for all tables at once and read their cells with one script (BATCH_EXTRACT),
+                  instead of a wait, a find and the outerHTML per table
+    :param record_dir: If set, save every page read there as a stub_server fixture
+    """
+
+    def __init__(self, driver, batch=BATCH_EXTRACT, record_dir=None):
+        self.driver = driver
+        self.batch = batch
+        self.record_dir = record_dir
+
+    def fetch_payload(self, stock_code):
+        """
+        Read the unit and the four tables from the rendered page, without parsing them.
+
+        :return: (fail_reason, payload) where fail_reason is None on success and payload is
+                 {"format": "cells" or "html", "unit": unit, "tables": {content name: table}}
+        """
+        result = self._fetch_batch(stock_code) if self.batch else self._fetch_html(stock_code)
+        if self.record_dir:
+            save_page(self.record_dir, stock_code, self.driver.page_source)
+        return result
+
+    def _fetch_html(self, stock_code):
+        driver = self.driver
+        wait = WebDriverWait(driver, 15)  # increase timeout for slow pages
         open_url(driver, stock_code)
         page_html = driver.page_source
 
         # give up if fund page
         if "基金概况" in page_html and "基金代码" in page_html:
             print(f"{stock_code} is a fund, skipping.")
-            append_fail_stocks(fail_stocks, stock_code, "Fund page")
-            stock_idx += 1
-            try_times = 1
-            driver.quit()
-            continue
+            return "Fund page", None
 
         # give up if page not found
         empty_divs = driver.find_elements(By.CSS_SELECTOR, "div.empty")
         if empty_divs:
             print(f"{stock_code} page not found, skipping.")
-            append_fail_stocks(fail_stocks, stock_code, "Page not found")
-            stock_idx += 1
-            try_times = 1
-            driver.quit()
-            continue
-            
+            return "Page not found", None
+
         unit_text = get_unit(driver, wait)
         unit = unit_text.split('：')[-1] if unit_text else None
 
+        tables = {}
         for content_name in content_list:
-            table_name = content_name.split('_')[-1]
-            df = get_finance_table(driver, wait, content_name)
-            df_new = clean_df(df)
-            df_transformed = tdfs.transform_data(df_new, stock_code, table_name, unit)
-            exisiting_df = df_dict[content_name][0] if len(df_dict[content_name]) > 0 else pd.DataFrame()
-            combined_df = pd.concat([exisiting_df, df_transformed], ignore_index=True)
-            df_dict[content_name] = [combined_df]
-            combined_df.to_csv(f"{table_name}_data.csv", index=False)
-            print(f"Saved {table_name}_data.csv with {len(combined_df)} records")
+            tables[content_name] = get_table_html(driver, wait, content_name)
             driver.execute_script("window.scrollBy(0, window.innerHeight/2);")
-        
-        success_stocks.append(stock_code)
-        stock_idx += 1
-        try_times = 1
-        driver.quit()
-    
-    # Change Proxy upon failure
-    except Exception as e:
-        print(f"[!!!] Error loading page for {stock_code}: {e}")
-        try_times += 1
-        use_proxy_index += 1
-        if use_proxy_index >= len(proxies_list):
-            print("Ran out of proxies and rolling back to the first proxy.")
-            use_proxy_index = 0
-        driver.quit()
-        continue
-
-driver.quit()
-
-print(f"Scraping completed. Successful stocks: {len(success_stocks)}, Failed stocks: {len(fail_stocks)}")
\ No newline at end of file
+        missing = [name for name, html in tables.items() if html is None]
+        if missing:
+            raise TimeoutException(f"Tables not loaded: {missing}")
+        return None, {"format": "html", "unit": unit, "tables": tables}
+
+    def _fetch_batch(self, stock_code):
+        open_url(self.driver, stock_code)
+        result = wait_for_tables(self.driver)
+        status = result["status"] if result else "loading"
+        if status == "fund":
+            print(f"{stock_code} is a fund, skipping.")
+            return "Fund page", None
+        if status == "empty":
+            print(f"{stock_code} page not found, skipping.")
+            return "Page not found", None
+        missing = result["missing"] if result else content_list
+        if missing:
+            raise TimeoutException(f"Tables not loaded: {missing}")
+        if result["unit"] is None:
+            print("Timed out: unit element not found.")
+        unit = result["unit"].split('：')[-1] if result["unit"] else None
+        return None, {"format": "cells", "unit": unit, "tables": result["tables"]}
+
+    def quit(self):
+        self.driver.quit()
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class PageReplayFetcher:
+    """
+    Offline fetch backend: download F10 pages recorded by BrowserFetcher from stub_server and
+    read the unit and tables out of the page HTML, as BrowserFetcher does with BATCH_EXTRACT off.
+    Everything after the fetch (read_html, clean_df, transform_data) is the scraper's own path;
+    the browser's rendering is not.
+
+    :param page_url: F10 page URL of a stub_server
+    """
+
+    def __init__(self, page_url=F10_URL, timeout=TABLE_WAIT_SECONDS):
+        self.page_url = page_url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def fetch_payload(self, stock_code):
+        """
+        :return: (fail_reason, payload) as BrowserFetcher.fetch_payload, in "html" format
+        """
+        with metrics.timer("driver_get"):
+            r = self.session.get(self.page_url, params={"code": stock_code}, timeout=self.timeout)
+        r.raise_for_status()
+        page = lxml.html.fromstring(r.text)
+        page_text = page.text_content()
+        if "基金概况" in page_text and "基金代码" in page_text:
+            print(f"{stock_code} is a fund, skipping.")
+            return "Fund page", None
+        if page.xpath(f"//div[{_has_class('empty')}]"):
+            print(f"{stock_code} page not found, skipping.")
+            return "Page not found", None
+        tables = {}
+        for content_name in content_list:
+            found = page.xpath(f"//div[{_has_class('content')} and {_has_class(content_name)}]"
+                               f"//table[{_has_class('commonTable')}]")
+            if found:
+                tables[content_name] = lxml.html.tostring(found[0], encoding="unicode")
+        missing = [name for name in content_list if name not in tables]
+        if missing:
+            raise ValueError(f"Tables not in the recorded page: {missing}")
+        unit_nodes = page.xpath("//*[contains(text(), '币种：')]")
+        unit = unit_nodes[0].text_content().split('：')[-1] if unit_nodes else None
+        return None, {"format": "html", "unit": unit, "tables": tables}
+
+    def quit(self):
+        self.session.close()
+
+
+def make_fetcher(proxy):
+    """
+    Create the fetch backend for one pool worker: a headless browser through `proxy`.
+    """
+    return BrowserFetcher(make_driver_with_proxy(proxy), record_dir=RECORD_DIR)
+
+
+def parse_payload(payload):
+    """
+    Turn a fetch backend's payload into the raw tables `tdfs.transform_data` expects.
+
+    :return: (unit, tables) where tables maps table name to the raw DataFrame
+    """
+    tables = {}
+    for content_name, table in payload["tables"].items():
+        if payload["format"] == "cells":
+            with metrics.timer("build_frames"):
+                df = table_frame(table)
+        else:
+            with metrics.timer("read_html"):
+                df = pd.read_html(StringIO(table))[0]
+        tables[content_name.split('_')[-1]] = clean_df(df)
+    return payload["unit"], tables
+
+
+def process_payload(stock_code, payload):
+    """
+    Parse and transform the fetched payload of one stock; CPU-bound, so the pipeline
+    runs it in worker processes.
+
+    :return: Dict of table name -> transformed DataFrame
+    """
+    unit, raw_tables = parse_payload(payload)
+    tables = {}
+    for table_name, df in raw_tables.items():
+        with metrics.timer("transform_data"):
+            tables[table_name] = tdfs.transform_data(df, stock_code, table_name, unit)
+    return tables
+
+
+def fetch_stock(fetcher, stock_code):
+    """
+    :return: (fail_reason, payload) of one stock, see `fetch_payload` of the fetch backends
+    """
+    with metrics.timer("fetch"):
+        return fetcher.fetch_payload(stock_code)
+
+
+def scrape_stock(fetcher, stock_code):
+    """
+    Scrape all finance tables of one stock with a fetch backend, fetching and
+    transforming in the calling thread.
+
+    :return: (fail_reason, tables) where fail_reason is None on success and
+             tables maps table name to the transformed DataFrame
+    """
+    fail_reason, payload = fetch_stock(fetcher, stock_code)
+    if fail_reason:
+        return fail_reason, {}
+    return None, process_payload(stock_code, payload)
+
+
+def prepare_jobs(store, stock_list):
+    """
+    Load stock codes into the job store and requeue only the stocks whose next interim/annual
+    report may be out, most urgent first. Stocks already in the store keep their state.
+    """
+    store.enqueue(stock_list, priority=report_calendar.PRIORITY_NEW)
+    date_df = report_calendar.load_stock_dates()
+    if date_df is not None:
+        schedule = report_calendar.build_schedule(date_df, stock_list, store.last_checked())
+        for priority, stocks in report_calendar.stocks_to_scrape(schedule).items():
+            if priority != report_calendar.PRIORITY_NEW:  # new stocks are already pending
+                store.requeue(stocks, priority=priority)
+        print("Report calendar (status scrape/total):", report_calendar.summarize(schedule))
+
+
+def run_scraper(store, feed, proxy_pool, writer, fetcher_factory=make_fetcher, num_workers=NUM_WORKERS,
+                parse_workers=PARSE_WORKERS, max_tries=None, limiter=None):
+    """
+    Scrape the stocks of `feed`, write them with `writer` and report the outcome of each to `store`.
+
+    :param store: JobStore, or a coordinator.CoordinatorClient on a coordinated worker
+    :param fetcher_factory: Callable proxy -> fetch backend
+    :param max_tries: Attempts per stock (default: one per healthy proxy)
+    :param limiter: RateLimiter pacing the requests (default: a new one with the default rates)
+    :return: (successful stock codes, failed stock codes, rate limiter)
+    """
+    success_stocks = []
+    fail_stocks = []
+    lock = threading.Lock()  # guards the writer and the result lists
+
+    def handle_result(stock_code, result):
+        fail_reason, tables = result
+        feed.keep_alive()  # stocks still retrying or waiting for a flush keep their leases
+        with lock:
+            if fail_reason:
+                feed.claimed.pop(stock_code, None)
+                fail_stocks.append(stock_code)
+                store.fail(stock_code, fail_reason)
+                metrics.incr("fail_reason", reason=REASON_CODES.get(fail_reason, fail_reason))
+                return
+            # only write the tables still pending for this stock
+            claimed = feed.claimed.pop(stock_code, list(tables))
+            writer.write_stock(stock_code, {t: df for t, df in tables.items() if t in claimed})
+            print(f"Saved {stock_code}: " + ", ".join(f"{t} {len(df)} records" for t, df in tables.items()))
+            success_stocks.append(stock_code)
+            metrics.incr("stocks_ok")
+
+    def handle_fail(stock_code, fail_reason):
+        with lock:
+            feed.claimed.pop(stock_code, None)
+            fail_stocks.append(stock_code)
+            store.fail(stock_code, fail_reason)
+            metrics.incr("fail_reason", reason=REASON_CODES.get(fail_reason, fail_reason))
+
+    # Requests are paced per proxy and overall, speeding up while the site answers and backing off when it doesn't
+    limiter = limiter or RateLimiter()
+    # Each fetch worker keeps one fetcher (HTTP session and/or headless driver, with proxy) alive across
+    # stocks and only downloads; worker processes parse and transform, one thread writes
+    pool = DriverPool(proxy_pool, fetcher_factory, size=num_workers, max_pages=MAX_PAGES_PER_DRIVER,
+                      max_tries=max_tries, limiter=limiter)
+    # pool = DriverPool(ProxyPool([None]), lambda proxy: BrowserFetcher(make_driver_without_proxy()), size=1) # Scrape without proxy
+    try:
+        if parse_workers:
+            Pipeline(pool, fetch_stock, process_payload, parse_workers=parse_workers).run(feed, handle_result, handle_fail)
+        else:
+            pool.run(feed, scrape_stock, handle_result, handle_fail)
+    finally:
+        writer.close()
+        store.release(list(feed.claimed))  # claimed but not finished
+    return success_stocks, fail_stocks, limiter
+
+
+if __name__ == "__main__":
+    # Load proxies: scored state from check_proxies.py if present, else the plain list
+    if os.path.exists(PROXY_POOL_PATH):
+        proxy_pool = ProxyPool.load(PROXY_POOL_PATH)
+    else:
+        proxy_pool = ProxyPool.load("valid_proxies.txt")
+    proxy_pool.start_revalidation(interval=PROXY_REVALIDATE_SECONDS, path=PROXY_POOL_PATH)
+
+    # Load stock codes into the job store, requeueing the stocks due a new report
+    stock_code_df = pd.read_csv("hk_stock_list_short.csv", dtype={"股份代號": str}) # whole stock list
+    stock_list = stock_code_df["股份代號"].tolist()
+    store = JobStore(JOB_STORE_PATH)
+    prepare_jobs(store, stock_list)
+    recovered = store.recover()  # single scraper process: in-progress jobs were left by a crash
+    if recovered:
+        print(f"Recovered {recovered} unfinished jobs from the previous run.")
+    print("Jobs:", store.counts())
+    feed = JobFeed(store, batch_size=CLAIM_BATCH_SIZE, limit=MAX_STOCKS_PER_RUN)
+    # Several processes or hosts: `python coordinator.py serve`, then `python coordinator.py work` on each
+
+    # Re-Scrape: `python check_stocks.py` requeues incomplete stocks, or
+    # store.requeue(['00798', '01218', '01905', '03399'])
+
+    # Each stock's rows are appended to its own partition; run `python partition_writer.py` to compact.
+    # Jobs are marked done only once their partition is durable.
+    writer = PartitionWriter(on_flush=store.complete, manifest=CoverageManifest(JOB_STORE_PATH),
+                             storage_format=STORAGE_FORMAT)
+
+    # Stage timings, retry/failure counters and per-proxy latency, written to METRICS_PATH at the end
+    if METRICS_ENABLED:
+        metrics.enable()
+        if METRICS_PORT:
+            metrics.start_http_server(METRICS_PORT)
+
+    # Start scraping
+    try:
+        success_stocks, fail_stocks, limiter = run_scraper(store, feed, proxy_pool, writer)
+    finally:
+        proxy_pool.stop()
+        proxy_pool.save(PROXY_POOL_PATH)
+        if METRICS_ENABLED:
+            metrics.write_json(METRICS_PATH)
+            metrics.stop_http_server()
+
+    print(f"Scraping completed. Successful stocks: {len(success_stocks)}, Failed stocks: {len(fail_stocks)}, "
+          f"Unchanged tables: {writer.unchanged}")
+    print("Jobs:", store.counts())
+    print(limiter.summary())
+    if METRICS_ENABLED:
+        print(metrics.summary())
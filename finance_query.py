@@ -0,0 +1,243 @@
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import parquet_store
+from transform_finance_data import FILE_TYPE_LIST, VERSION_FILE
+
+OUTPUT_PATH = 'transformed_finance_data/'
+PIVOT_CACHE_SIZE = 64  # wide pivots kept across all tables
+# Repeated strings, stored as category codes
+CATEGORY_COLUMNS = ['股票代码', '股份簡稱', '指标组', '指标名称', '币种', '数值']
+INT_COLUMNS = ['年结月', '是否年报', '是否最新报表', 'order_index']
+STOCK_COL = '股票代码'
+GROUP_COL = '指标组'
+INDICATOR_COL = '指标名称'
+DATE_COL = '报表截止日'
+
+
+def output_file(path, file_type):
+    """The transformed output of a type: `{type}_data.parquet` if present, else `{type}_data.csv`."""
+    parquet_path = os.path.join(path, f'{file_type}_data.parquet')
+    return parquet_path if os.path.exists(parquet_path) else os.path.join(path, f'{file_type}_data.csv')
+
+
+def load_output(path):
+    """
+    Read a transformed output compactly: repeated strings and report dates as categoricals,
+    flags and months as the narrowest integers that hold them.
+    """
+    if path.endswith('.parquet'):
+        df = parquet_store.read_parquet(path, categories=True)
+    else:
+        df = pd.read_csv(path, dtype={c: 'category' for c in CATEGORY_COLUMNS})
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    df[DATE_COL] = pd.Categorical(parquet_store.parse_dates(df[DATE_COL]))
+    for col in INT_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+
+def group_positions(codes, categories):
+    """
+    :param codes: Category codes of a column (-1 for missing)
+    :return: Dict of category -> sorted row positions holding it
+    """
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.diff(codes[order])) + 1
+    keys = codes[order[np.r_[0, starts]]] if len(order) else []
+    return {categories[k]: rows for k, rows in zip(keys, np.split(order, starts)) if k >= 0}
+
+
+def check_unique(df, keys):
+    """Raise ValueError if several rows share the same `keys`, rather than pivot one of them away."""
+    duplicated = df.duplicated(keys, keep=False).to_numpy()
+    if duplicated.any():
+        groups = sorted(set(df[GROUP_COL].to_numpy()[duplicated].astype(str))) if GROUP_COL not in keys else []
+        hint = f" (in 指标组 {', '.join(groups)}; pass group=)" if len(groups) > 1 else ""
+        raise ValueError(f"{duplicated.sum()} rows share their {', '.join(keys)}{hint}")
+
+
+class FinanceTable:
+    """
+    One transformed output held in memory with an index per stock, indicator group, indicator and report date.
+
+    Rows are sorted by stock (keeping the transform's order within a stock). Each index maps a
+    key to its row positions; a lookup on several keys starts from the smallest of their
+    position lists and keeps the rows whose other columns match, so it touches only those rows.
+    """
+
+    def __init__(self, df):
+        order = np.argsort(df[STOCK_COL].cat.codes.to_numpy(), kind='stable')
+        self.df = df.iloc[order].reset_index(drop=True)
+        self._codes = {}  # column -> category codes
+        self._index = {}  # column -> {key: row positions}
+        for col in (STOCK_COL, GROUP_COL, INDICATOR_COL, DATE_COL):
+            codes = self.df[col].cat.codes.to_numpy()
+            self._codes[col] = codes
+            self._index[col] = group_positions(codes, self.df[col].cat.categories)
+
+    def __len__(self):
+        return len(self.df)
+
+    def stocks(self):
+        return list(self._index[STOCK_COL])
+
+    def indicators(self):
+        return list(self._index[INDICATOR_COL])
+
+    def dates(self):
+        return sorted(self._index[DATE_COL])
+
+    def rows(self, stock_code=None, indicator=None, date=None, group=None):
+        """
+        :param group: 指标组; indicator names such as 其他 appear in several groups
+        :return: Sorted positions of the rows matching every key given (all rows if none)
+        """
+        keys = [(col, key) for col, key in ((STOCK_COL, stock_code), (GROUP_COL, group), (INDICATOR_COL, indicator),
+                                            (DATE_COL, None if date is None else pd.Timestamp(date)))
+                if key is not None]
+        if not keys:
+            return np.arange(len(self.df))
+        empty = np.empty(0, dtype=np.intp)
+        lists = [(self._index[col].get(key, empty), col, key) for col, key in keys]
+        lists.sort(key=lambda item: len(item[0]))
+        rows = lists[0][0]
+        for _, col, key in lists[1:]:
+            if not len(rows):
+                break
+            rows = rows[self._codes[col][rows] == self.df[col].cat.categories.get_loc(key)]
+        return rows
+
+    def select(self, stock_code=None, indicator=None, date=None, columns=None, group=None):
+        """
+        :return: DataFrame of the matching rows (a copy), optionally only some columns
+        """
+        df = self.df if columns is None else self.df[columns]
+        return df.iloc[self.rows(stock_code, indicator, date, group)]
+
+    def cross_section(self, indicator, date, group=None):
+        """
+        One indicator across all stocks for one report date.
+
+        :param group: 指标组 of the indicator, needed when its name appears in several groups
+        :return: Series of value indexed by 股票代码
+        """
+        rows = self.rows(indicator=indicator, date=date, group=group)
+        check_unique(self.df[[STOCK_COL, GROUP_COL]].iloc[rows], [STOCK_COL])
+        stocks = self.df[STOCK_COL].cat.categories[self._codes[STOCK_COL][rows]]
+        return pd.Series(self.df['value'].to_numpy()[rows], index=pd.Index(stocks, name=STOCK_COL), name=indicator)
+
+    def pivot_stock(self, stock_code):
+        """
+        :return: Wide frame of one stock: report dates x (指标组, 指标名称) (in the transform's order), of value
+        """
+        df = self.select(stock_code=stock_code, columns=[DATE_COL, GROUP_COL, INDICATOR_COL, 'value'])
+        check_unique(df, [DATE_COL, GROUP_COL, INDICATOR_COL])
+        wide = df.pivot_table(index=DATE_COL, columns=[GROUP_COL, INDICATOR_COL], values='value', aggfunc='first',
+                              observed=True, sort=False)
+        return wide.sort_index()
+
+    def pivot_indicator(self, indicator, group=None):
+        """
+        :param group: 指标组 of the indicator, needed when its name appears in several groups
+        :return: Wide frame of one indicator: stocks x report dates, of value
+        """
+        df = self.select(indicator=indicator, columns=[STOCK_COL, DATE_COL, GROUP_COL, 'value'], group=group)
+        check_unique(df, [STOCK_COL, DATE_COL])
+        wide = df.pivot_table(index=STOCK_COL, columns=DATE_COL, values='value', aggfunc='first', observed=True)
+        return wide.sort_index(axis=1)
+
+
+class FinanceQuery:
+    """
+    Query the outputs of transform_finance_data without re-reading them: each type is loaded
+    once into a FinanceTable, and wide pivots are kept in an LRU cache of `cache_size` entries.
+
+    Every query first checks the version marker the transform writes after each run (or, for
+    outputs written before markers existed, the output files themselves); when it changed, the
+    tables are reloaded and the pivot cache cleared. Pivots are returned as copies, so callers
+    may modify them.
+
+    :param path: Directory of the transformed outputs
+    """
+
+    def __init__(self, path=OUTPUT_PATH, file_types=FILE_TYPE_LIST, cache_size=PIVOT_CACHE_SIZE):
+        self.path = path
+        self.file_types = [t for t in file_types if os.path.exists(output_file(path, t))]
+        self.tables = {}
+        self._version = None
+        self._pivot = lru_cache(maxsize=cache_size)(self._build_pivot)
+        self.refresh()
+
+    def version(self):
+        marker = os.path.join(self.path, VERSION_FILE)
+        paths = [marker] if os.path.exists(marker) else [output_file(self.path, t) for t in self.file_types]
+        return tuple((p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths if os.path.exists(p))
+
+    def refresh(self):
+        """
+        Reload the tables if the transform wrote new outputs.
+
+        :return: True if they were reloaded
+        """
+        version = self.version()
+        if version == self._version:
+            return False
+        start = time.time()
+        self.tables = {t: FinanceTable(load_output(output_file(self.path, t))) for t in self.file_types}
+        self._pivot.cache_clear()
+        self._version = version
+        print(f"Loaded {sum(len(t) for t in self.tables.values())} rows of {', '.join(self.tables)} "
+              f"in {time.time() - start:.1f}s")
+        return True
+
+    def table(self, file_type):
+        self.refresh()
+        return self.tables[file_type]
+
+    def select(self, file_type, stock_code=None, indicator=None, date=None, columns=None, group=None):
+        return self.table(file_type).select(stock_code, indicator, date, columns, group)
+
+    def cross_section(self, file_type, indicator, date, group=None):
+        return self.table(file_type).cross_section(indicator, date, group)
+
+    def _build_pivot(self, file_type, by, key, group=None):
+        table = self.tables[file_type]
+        return table.pivot_stock(key) if by == STOCK_COL else table.pivot_indicator(key, group)
+
+    def pivot_stock(self, file_type, stock_code):
+        self.refresh()
+        return self._pivot(file_type, STOCK_COL, stock_code).copy()
+
+    def pivot_indicator(self, file_type, indicator, group=None):
+        self.refresh()
+        return self._pivot(file_type, INDICATOR_COL, indicator, group).copy()
+
+    def cache_info(self):
+        return self._pivot.cache_info()
+
+    def memory_usage(self):
+        """:return: Dict of type -> bytes held by its table"""
+        return {t: int(table.df.memory_usage(deep=True).sum()) for t, table in self.tables.items()}
+
+
+if __name__ == "__main__":
+    query = FinanceQuery(OUTPUT_PATH)
+    print({t: f"{n / 2 ** 20:.1f} MiB" for t, n in query.memory_usage().items()})
+    lrb = query.table('lrb')
+    stock_code, indicator, date = lrb.stocks()[0], lrb.indicators()[0], lrb.dates()[-1]
+    for name, fn in [("select stock", lambda: query.select('lrb', stock_code=stock_code)),
+                     ("cross section", lambda: query.cross_section('lrb', indicator, date)),
+                     ("pivot stock", lambda: query.pivot_stock('lrb', stock_code)),
+                     ("pivot indicator", lambda: query.pivot_indicator('lrb', indicator))]:
+        start = time.perf_counter()
+        fn()
+        print(f"{name}: {(time.perf_counter() - start) * 1000:.2f} ms")
+    print(query.cross_section('lrb', indicator, date).head())
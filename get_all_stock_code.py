@@ -2,56 +2,202 @@ from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 from io import StringIO
+import datetime
+import os
 import time
 import pandas as pd
+import requests
 
-options = Options()
-options.add_argument("--headless=new")  # headless mode
-driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-wait = WebDriverWait(driver, 60)  # increase timeout for slow pages
+from driver_pool import get_driver_path
+import transform_stock_code as tsc
 
+STOCK_LIST_URL = "https://www.hkexnews.hk/stocklist_active_main_c.htm"
+USER_AGENT = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+              "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/143.0.0.0 Safari/537.36")
+STOCK_LIST_PATH = "hk_stock_list.csv"  # the page's table as is
+SHORT_LIST_PATH = "hk_stock_list_short.csv"  # 5-digit codes and names, read by the scraper and the transform
+CHANGES_PATH = "stock_list_changes.csv"  # listings, delistings and renames found by each refresh
+ROW_SELECTOR = "table.table-stocklist tbody tr"
+LOAD_TIMEOUT = 60  # seconds for the whole list to load in the browser
+SETTLE_SECONDS = 3  # stop scrolling once the row count has not changed for this long
+CODE_COL = '股份代號'
+NAME_COL = '股份簡稱'
 
-def open_url(driver):
-    url = f"https://www.hkexnews.hk/stocklist_active_main_c.htm"
+# Listing changes
+LISTED = "listed"
+DELISTED = "delisted"
+RENAMED = "renamed"
+
+
+def read_stock_list_http(url=STOCK_LIST_URL, timeout=30):
+    """
+    Read the stock list page directly: the full table is in the page HTML.
+
+    :return: DataFrame of the table, None if the page has no stock list table
+    """
+    r = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=timeout)
+    r.raise_for_status()
+    if r.encoding is None or r.encoding.lower() == "iso-8859-1":
+        r.encoding = r.apparent_encoding  # no charset in the headers
+    try:
+        return pd.read_html(StringIO(r.text), attrs={"class": "table-stocklist"})[0]
+    except ValueError:  # no tables found
+        return None
+
+
+def make_driver():
+    options = Options()
+    options.add_argument("--headless=new")  # headless mode
+    return webdriver.Chrome(service=Service(get_driver_path()), options=options)
+
+
+def open_url(driver, url=STOCK_LIST_URL):
     driver.get(url)
 
 
-def load_all_rows_by_scrolling(driver, pause=1.0, max_iter=100):
-    prev = -1
-    for _ in range(max_iter):
+def count_rows(driver):
+    return driver.execute_script("return document.querySelectorAll(arguments[0]).length", ROW_SELECTOR)
+
+
+def load_all_rows_by_scrolling(driver, timeout=LOAD_TIMEOUT, settle=SETTLE_SECONDS):
+    """
+    Scroll until the table stops growing, waiting on the row count instead of a fixed sleep.
+
+    :return: Number of rows loaded
+    """
+    deadline = time.monotonic() + timeout
+    rows = count_rows(driver)
+    while time.monotonic() < deadline:
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(pause)
-        rows = driver.find_elements(By.CSS_SELECTOR, "table.table-stocklist tbody tr")
-        if len(rows) == prev:
-            break
-        prev = len(rows)
+        try:
+            WebDriverWait(driver, settle, poll_frequency=0.1).until(lambda d: count_rows(d) != rows)
+        except TimeoutException:
+            break  # no new rows within `settle` seconds
+        rows = count_rows(driver)
     return rows
 
 
-def get_all_stock_codes(driver, wait):
-    try:
-        # Wait for the stock list table to load
-        load_all_rows_by_scrolling(driver)
-        table = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "table.table-stocklist")))
-        print(table)
-        html = table.get_attribute("outerHTML")
-        df = pd.read_html(StringIO(html))[0]
-        print(len(df))
-        print(df.head())
-        df.to_csv("hk_stock_list.csv", index=False)
-        return df
+def read_stock_list_browser(driver):
+    """
+    Render the stock list page and read its table once every row has loaded.
 
+    :return: DataFrame of the table, None if it did not load
+    """
+    open_url(driver)
+    try:
+        table = WebDriverWait(driver, LOAD_TIMEOUT).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "table.table-stocklist")))
     except TimeoutException:
         print("Timed out: stock list table not found.")
-        page_html = driver.page_source
-        print(page_html)
+        return None
+    rows = load_all_rows_by_scrolling(driver)
+    print(f"Loaded {rows} rows in the browser.")
+    return pd.read_html(StringIO(table.get_attribute("outerHTML")))[0]
+
+
+def get_all_stock_codes():
+    """
+    Read the HKEX stock list, from the page HTML or, if that fails, in a browser.
+
+    :return: DataFrame of the table, None if neither worked
+    """
+    try:
+        df = read_stock_list_http()
+        if df is not None and len(df):
+            return df
+        print("Stock list page has no table, loading it in the browser.")
+    except Exception as e:
+        print(f"Direct read failed ({type(e).__name__}: {e}), loading the page in the browser.")
+    driver = make_driver()
+    try:
+        return read_stock_list_browser(driver)
+    finally:
         driver.quit()
-    return None
 
-open_url(driver)
-stock_df = get_all_stock_codes(driver, wait)
\ No newline at end of file
+
+def short_list(df):
+    """
+    :return: Codes (5 digits) and names of the listed stocks
+    """
+    short = tsc.transform_stock_code(df[[CODE_COL, NAME_COL]].copy(), CODE_COL)
+    return short.drop_duplicates(CODE_COL).reset_index(drop=True)
+
+
+def diff_listings(old_df, new_df):
+    """
+    Compare two short lists by stock code.
+
+    :return: DataFrame of 股份代號, change (listed, delisted or renamed), old and new 股份簡稱
+    """
+    merged = pd.merge(old_df[[CODE_COL, NAME_COL]], new_df[[CODE_COL, NAME_COL]], on=CODE_COL,
+                      how='outer', suffixes=('_old', '_new'), indicator=True)
+    old_name, new_name = merged[NAME_COL + '_old'], merged[NAME_COL + '_new']
+    change = pd.Series(None, index=merged.index, dtype=object)
+    change[merged['_merge'] == 'right_only'] = LISTED
+    change[merged['_merge'] == 'left_only'] = DELISTED
+    change[(merged['_merge'] == 'both') & (old_name.fillna('') != new_name.fillna(''))] = RENAMED
+    diff = pd.DataFrame({CODE_COL: merged[CODE_COL], 'change': change,
+                         'old_name': old_name, 'new_name': new_name})
+    return diff[diff['change'].notna()].sort_values(CODE_COL).reset_index(drop=True)
+
+
+def load_short_list(path=SHORT_LIST_PATH):
+    if not os.path.exists(path):
+        return pd.DataFrame({CODE_COL: pd.Series(dtype=str), NAME_COL: pd.Series(dtype=str)})
+    return pd.read_csv(path, dtype={CODE_COL: str})
+
+
+def queue_changes(store, diff):
+    """
+    Queue scrapes for the changed stocks only: new listings, and renamed stocks since
+    HKEX reuses the codes of delisted companies. Unfinished jobs of delisted stocks
+    are failed with reason "delisted" so they are not claimed.
+    """
+    from report_calendar import PRIORITY_NEW
+
+    listed = diff.loc[diff['change'] == LISTED, CODE_COL].tolist()
+    renamed = diff.loc[diff['change'] == RENAMED, CODE_COL].tolist()
+    store.enqueue(listed, priority=PRIORITY_NEW)
+    store.requeue(renamed, priority=PRIORITY_NEW)
+    for stock_code in diff.loc[diff['change'] == DELISTED, CODE_COL]:
+        store.fail(stock_code, DELISTED)
+
+
+def refresh(store=None):
+    """
+    Read the current stock list, diff it against the saved short list and save it if it changed.
+
+    :param store: JobStore to queue changed stocks in, None to only update the files
+    :return: Diff from diff_listings, None if the list could not be read
+    """
+    df = get_all_stock_codes()
+    if df is None:
+        return None
+    new_short = short_list(df)
+    old_short = load_short_list()
+    diff = diff_listings(old_short, new_short)
+    counts = diff['change'].value_counts()
+    print(f"{len(new_short)} stocks listed: " + ", ".join(f"{counts.get(c, 0)} {c}" for c in (LISTED, DELISTED, RENAMED)))
+    if diff.empty and os.path.exists(STOCK_LIST_PATH):
+        return diff  # nothing to rewrite or queue
+
+    df.to_csv(STOCK_LIST_PATH, index=False)
+    new_short.to_csv(SHORT_LIST_PATH, index=False)
+    if not diff.empty and not old_short.empty:  # a first list is not a change
+        diff.insert(0, 'date', datetime.date.today().isoformat())
+        diff.to_csv(CHANGES_PATH, mode='a', header=not os.path.exists(CHANGES_PATH), index=False)
+    if store is not None:
+        queue_changes(store, diff)
+    return diff
+
+
+if __name__ == "__main__":
+    from job_store import JobStore, JOB_STORE_PATH
+
+    diff = refresh(JobStore(JOB_STORE_PATH))
+    if diff is not None and not diff.empty:
+        print(diff.to_string(index=False))
@@ -0,0 +1,290 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from partition_writer import TABLE_NAMES
+
+JOB_STORE_PATH = "scrape_state.db"
+LEASE_SECONDS = 600
+
+# Job states
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+# Fail reason codes, keyed by the reason the scraper reports
+REASON_CODES = {
+    "Fund page": "fund_page",
+    "Page not found": "page_not_found",
+    "Exceeded maximum retry attempts": "max_retries",
+    "Parse error": "parse_error",
+}
+
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobStore:
+    """
+    Durable work queue with one job per (stock, table), stored in SQLite.
+
+    Workers claim whole stocks atomically with a lease; a job whose lease
+    expires (its worker died) can be claimed again. Safe to share between
+    threads and between processes on the same machine.
+    """
+
+    def __init__(self, path=JOB_STORE_PATH, lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                stock_code TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                reason TEXT,
+                seq INTEGER NOT NULL DEFAULT 0,
+                priority INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL,
+                PRIMARY KEY (stock_code, table_name)
+            );
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "priority" not in columns:  # store created before priorities existed
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("DROP INDEX IF EXISTS jobs_state")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, priority DESC, seq)")
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, stock_codes, table_names=TABLE_NAMES, priority=0):
+        """
+        Add pending jobs for stocks not in the store yet; existing jobs keep their state.
+        Higher priorities are claimed first, then stocks in the order given.
+        """
+        now = time.time()
+
+        def run(conn):
+            start = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM jobs").fetchone()[0]
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (stock_code, table_name, seq, priority, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(s, t, start + i + 1, priority, now) for i, s in enumerate(stock_codes) for t in table_names])
+        self._transaction(run)
+
+    def claim_batch(self, owner, n):
+        """
+        Atomically lease up to `n` stocks that have pending or expired jobs. Expired leases of
+        `owner` itself are skipped: those stocks are still being retried or written by it.
+
+        :return: Dict of stock code -> list of claimed table names, in queue order
+        """
+        now = time.time()
+
+        def run(conn):
+            rows = conn.execute(
+                "SELECT stock_code, table_name FROM jobs "
+                "WHERE state = ? OR (state = ? AND lease_expires < ? AND lease_owner IS NOT ?) "
+                "ORDER BY priority DESC, seq, table_name LIMIT ?",
+                (PENDING, IN_PROGRESS, now, owner, n * len(TABLE_NAMES))).fetchall()
+            claimed = {}
+            for stock_code, table_name in rows:
+                if stock_code not in claimed and len(claimed) >= n:
+                    break
+                claimed.setdefault(stock_code, []).append(table_name)
+            conn.executemany(
+                "UPDATE jobs SET state = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE stock_code = ? AND table_name = ?",
+                [(IN_PROGRESS, owner, now + self.lease_seconds, now, s, t)
+                 for s, tables in claimed.items() for t in tables])
+            return claimed
+        return self._transaction(run)
+
+    def complete(self, jobs):
+        """
+        Mark jobs done.
+
+        :param jobs: Iterable of (stock_code, table_name)
+        """
+        now = time.time()
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, reason = NULL, updated_at = ? "
+            "WHERE stock_code = ? AND table_name = ?",
+            [(DONE, now, s, t) for s, t in jobs]))
+
+    def fail(self, stock_code, reason):
+        """
+        Mark every unfinished job of a stock failed.
+
+        :param reason: Reason code, or a scraper fail reason listed in REASON_CODES
+        """
+        reason = REASON_CODES.get(reason, reason)
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, reason = ?, updated_at = ? "
+            "WHERE stock_code = ? AND state != ?",
+            (FAILED, reason, time.time(), stock_code, DONE)))
+
+    def release(self, stock_codes):
+        """Return the unfinished jobs of these stocks to pending (e.g. on shutdown)."""
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL WHERE stock_code = ? AND state = ?",
+            [(PENDING, s, IN_PROGRESS) for s in stock_codes]))
+
+    def renew(self, owner):
+        """
+        Extend the leases of every in-progress job of `owner` (worker heartbeat).
+
+        :return: Number of jobs renewed
+        """
+        now = time.time()
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET lease_expires = ? WHERE lease_owner = ? AND state = ?",
+            (now + self.lease_seconds, owner, IN_PROGRESS)).rowcount)
+
+    def release_owner(self, owner):
+        """
+        Return every in-progress job of `owner` to pending, e.g. when that worker died.
+
+        :return: Number of jobs released
+        """
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ? AND state = ?",
+            (PENDING, owner, IN_PROGRESS)).rowcount)
+
+    def recover(self):
+        """
+        Return every in-progress job to pending. Only call this when no other
+        worker is running, e.g. when a single scraper process restarts after a crash.
+
+        :return: Number of jobs recovered
+        """
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL WHERE state = ?",
+            (PENDING, IN_PROGRESS)).rowcount)
+
+    def requeue(self, stock_codes, table_names=TABLE_NAMES, priority=0):
+        """
+        Set the jobs of these stocks back to pending whatever their state, adding missing ones.
+        """
+        self.enqueue(stock_codes, table_names, priority)
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, reason = NULL, priority = ?, "
+            "updated_at = ? WHERE stock_code = ? AND table_name = ?",
+            [(PENDING, priority, time.time(), s, t) for s in stock_codes for t in table_names]))
+
+    def retry_failed(self, reasons=None, stock_codes=None):
+        """
+        Return failed jobs to pending, optionally only for some reason codes or stocks.
+
+        :return: Number of jobs requeued
+        """
+        query = "UPDATE jobs SET state = ?, reason = NULL WHERE state = ?"
+        params = [PENDING, FAILED]
+        if reasons is not None:
+            query += f" AND reason IN ({','.join('?' * len(reasons))})"
+            params += list(reasons)
+        if stock_codes is not None:
+            query += f" AND stock_code IN ({','.join('?' * len(stock_codes))})"
+            params += list(stock_codes)
+        return self._transaction(lambda conn: conn.execute(query, params).rowcount)
+
+    def counts(self):
+        """
+        :return: Dict of state -> number of jobs
+        """
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def owners(self):
+        """
+        :return: Dict of lease owner -> number of its in-progress jobs
+        """
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT lease_owner, COUNT(*) FROM jobs WHERE state = ? GROUP BY lease_owner", (IN_PROGRESS,)).fetchall())
+
+    def failed(self):
+        """
+        :return: Dict of stock code -> reason code for stocks with failed jobs
+        """
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT stock_code, MAX(reason) FROM jobs WHERE state = ? GROUP BY stock_code", (FAILED,)).fetchall())
+
+    def last_checked(self):
+        """
+        :return: Dict of stock code -> time (epoch seconds) its jobs were last completed
+        """
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT stock_code, MAX(updated_at) FROM jobs WHERE state = ? GROUP BY stock_code", (DONE,)).fetchall())
+
+    def close(self):
+        self._conn.close()
+
+
+class JobFeed:
+    """
+    Thread-safe iterator over stocks claimed from a JobStore in batches, for DriverPool.run.
+
+    Stocks can stay leased longer than the store's lease while they are retried or wait for
+    the writer's next flush, so the owner's leases are renewed every `renew_seconds` (a third
+    of the lease by default) as stocks are taken and from `keep_alive`.
+
+    :param limit: Stop after this many stocks (None for no limit)
+    """
+
+    def __init__(self, store, owner=None, batch_size=10, limit=None, renew_seconds=None):
+        self.store = store
+        self.owner = owner or default_owner()
+        self.batch_size = batch_size
+        self.limit = limit
+        self.renew_seconds = renew_seconds or getattr(store, "lease_seconds", LEASE_SECONDS) / 3
+        self.claimed = {}  # stock code -> claimed table names
+        self._buffer = []
+        self._taken = 0
+        self._renewed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def keep_alive(self):
+        """Renew the owner's leases if `renew_seconds` have passed; call it while results come in."""
+        now = time.monotonic()
+        if now - self._renewed < self.renew_seconds:
+            return
+        self._renewed = now
+        self.store.renew(self.owner)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.keep_alive()
+        with self._lock:
+            if self.limit is not None and self._taken >= self.limit:
+                raise StopIteration
+            if not self._buffer:
+                n = self.batch_size if self.limit is None else min(self.batch_size, self.limit - self._taken)
+                batch = self.store.claim_batch(self.owner, n)
+                self.claimed.update(batch)
+                self._buffer = list(batch)
+            if not self._buffer:
+                raise StopIteration
+            self._taken += 1
+            return self._buffer.pop(0)
@@ -0,0 +1,269 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PATH = "scrape_metrics.json"
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum, "max": self.max,
+                "buckets": {str(b): n for b, n in zip(self.buckets, self.counts)}}
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def proxy_label(proxy):
+    """'user:pass@ip:port' -> 'ip:port', so credentials never reach the metrics outputs."""
+    return str(proxy).rpartition("@")[2]
+
+
+def _key(name, labels):
+    if "proxy" in labels:
+        labels = dict(labels, proxy=proxy_label(labels["proxy"]))
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    # Prometheus label value escaping
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Metrics:
+    """
+    Counters and latency histograms, keyed by name and labels. Disabled until
+    `enable()`: timers, counters and observations are then no-ops.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._server = None
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.time()
+        return self
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def incr(self, name, n=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(seconds)
+
+    def timer(self, stage, **labels):
+        """
+        Time a block into the `stage_seconds` histogram:
+
+            with metrics.timer("driver_get"):
+                driver.get(url)
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, "stage_seconds", dict(labels, stage=stage))
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def drain(self):
+        """
+        Take everything recorded so far and start over, e.g. in a worker process that
+        sends its metrics back to the main process with each result.
+
+        :return: (counters, histograms), for `merge`
+        """
+        with self._lock:
+            drained = self._counters, self._histograms
+            self._counters, self._histograms = {}, {}
+        return drained
+
+    def merge(self, drained):
+        """Add metrics taken with `drain` (in another process) to this registry."""
+        counters, histograms = drained
+        with self._lock:
+            for key, n in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + n
+            for key, other in histograms.items():
+                hist = self._histograms.get(key)
+                if hist is None:
+                    hist = self._histograms[key] = Histogram(other.buckets)
+                hist.merge(other)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "elapsed": time.time() - self.started,
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self._counters.items())],
+                "histograms": [dict(name=name, labels=dict(labels), **hist.to_dict())
+                               for (name, labels), hist in sorted(self._histograms.items())],
+            }
+
+    def write_json(self, path=METRICS_PATH):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"scraper_{name}_total{_label_text(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, n in zip(hist.buckets, hist.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"scraper_{name}_bucket{_label_text(labels + (('le', le),))} {cumulative}")
+                lines.append(f"scraper_{name}_sum{_label_text(labels)} {hist.sum}")
+                lines.append(f"scraper_{name}_count{_label_text(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port, host="127.0.0.1"):
+        """Serve `prometheus_text()` on http://host:port/metrics from a background thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics-server").start()
+        return self._server
+
+    def stop_http_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+    def summary(self, top_proxies=5):
+        """
+        :return: Human-readable run summary: stage timings, counters and the slowest proxies
+        """
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        lines = [f"Run summary ({time.time() - self.started:.0f}s)"]
+        stages = sorted(((dict(labels)["stage"], h) for (name, labels), h in histograms.items()
+                         if name == "stage_seconds"), key=lambda x: -x[1].sum)
+        if stages:
+            lines.append(f"  {'stage':<18}{'count':>8}{'total s':>10}{'mean ms':>10}{'p50 ms':>9}{'p99 ms':>9}")
+        for stage, h in stages:
+            lines.append(f"  {stage:<18}{h.count:>8}{h.sum:>10.1f}{h.sum / h.count * 1000:>10.0f}"
+                         f"{h.quantile(0.5) * 1000:>9.0f}{h.quantile(0.99) * 1000:>9.0f}")
+        for (name, labels), value in sorted(counters.items()):
+            if name != "proxy_failures":
+                lines.append(f"  {name}{_label_text(labels)}: {value}")
+        proxy_failures = sum(v for (name, _), v in counters.items() if name == "proxy_failures")
+        lines.append(f"  proxy_failures: {proxy_failures}")
+        proxies = sorted(((dict(labels)["proxy"], h) for (name, labels), h in histograms.items()
+                          if name == "proxy_latency_seconds"), key=lambda x: -x[1].sum / x[1].count)
+        for proxy, h in proxies[:top_proxies]:
+            lines.append(f"  slow proxy {proxy}: {h.count} pages, mean {h.sum / h.count * 1000:.0f} ms, "
+                         f"max {h.max * 1000:.0f} ms")
+        return "\n".join(lines)
+
+
+# Process-wide registry used by the scraper modules
+metrics = Metrics()
@@ -0,0 +1,172 @@
+import os
+
+import pandas as pd
+
+# Strings repeated on every row, stored dictionary-encoded
+DICTIONARY_COLUMNS = ['股票代码', '股份簡稱', '年结日', '指标组', '指标名称', '币种', 'unit']
+# Free text (数值 keeps its unit suffix in raw tables)
+STRING_COLUMNS = ['数值']
+# Report dates, stored as date32; raw tables carry them as 'YY-MM-DD'
+DATE_COLUMNS = ['报表截止日', '截止日期', '最新报表截止日']
+# Small integer columns: name -> arrow type name
+INT_COLUMNS = {'年结月': 'int8', '报表月': 'int8', '是否年报': 'int8', '是否最新报表': 'int8', 'order_index': 'int32'}
+FLOAT_COLUMNS = ['value']
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet storage needs pyarrow: pip install pyarrow") from e
+    return pa, ds, pq
+
+
+def parse_dates(values):
+    """
+    Report dates as datetime64, accepting 'YY-MM-DD' (raw pages), 'YYYY-MM-DD' and date objects.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    text = values.astype(str)
+    text = text.where(text.str.len() != 8, '20' + text)
+    return pd.to_datetime(text, errors='coerce')
+
+
+def _strings(col):
+    return col.astype(str).where(col.notna(), None)
+
+
+def to_arrow(df):
+    """
+    Convert a raw or transformed frame to an Arrow table: dictionary-encoded strings,
+    date32 report dates and narrow integers. Unknown columns keep their inferred type.
+    """
+    pa, _, _ = _pyarrow()
+    arrays = []
+    for name in df.columns:
+        col = df[name]
+        if name in DICTIONARY_COLUMNS:
+            arr = pa.array(_strings(col), type=pa.string()).dictionary_encode()
+        elif name in STRING_COLUMNS:
+            arr = pa.array(_strings(col), type=pa.string())
+        elif name in DATE_COLUMNS:
+            arr = pa.array(parse_dates(col).dt.date, type=pa.date32(), from_pandas=True)
+        elif name in INT_COLUMNS:
+            arr = pa.array(col, type=getattr(pa, INT_COLUMNS[name])(), from_pandas=True)
+        elif name in FLOAT_COLUMNS:
+            arr = pa.array(pd.to_numeric(col, errors='coerce'), type=pa.float64(), from_pandas=True)
+        else:
+            arr = pa.array(col, from_pandas=True)
+        arrays.append(arr)
+    return pa.table(arrays, names=[str(c) for c in df.columns])
+
+
+def write_parquet(df, path):
+    """Write a frame to one Parquet file (zstd, dictionary pages)."""
+    _, _, pq = _pyarrow()
+    pq.write_table(to_arrow(df), path, compression='zstd', use_dictionary=True)
+
+
+def _decode_dictionaries(table):
+    pa, _, _ = _pyarrow()
+    fields = [pa.field(f.name, f.type.value_type) if pa.types.is_dictionary(f.type) else f for f in table.schema]
+    return table.cast(pa.schema(fields))
+
+
+def read_parquet(source, columns=None, filters=None, categories=False):
+    """
+    Read Parquet files as one DataFrame, loading only the requested columns and
+    skipping row groups that cannot match `filters`.
+
+    :param source: A .parquet file, a directory of them, or a list of files
+    :param columns: Columns to load (None for all); columns missing from the files are skipped
+    :param filters: pyarrow.dataset expression, or (column, op, value) tuples as in pandas.read_parquet
+    :param categories: Return dictionary-encoded columns as pandas categoricals instead of strings
+    :return: DataFrame with report dates as datetime64
+    """
+    _, ds, pq = _pyarrow()
+    dataset = ds.dataset(source, format='parquet')
+    if columns is not None:
+        columns = [c for c in columns if c in dataset.schema.names]
+    if filters is not None and not isinstance(filters, ds.Expression):
+        filters = pq.filters_to_expression(filters)
+    table = dataset.to_table(columns=columns, filter=filters)
+    if not categories:
+        table = _decode_dictionaries(table)
+    return table.to_pandas(date_as_object=False)
+
+
+def iter_parquet(source, columns=None, filters=None, batch_rows=100_000):
+    """
+    Like read_parquet, as one DataFrame per batch of at most `batch_rows` rows, in file order,
+    so a large file never has to fit in memory at once.
+    """
+    pa, ds, pq = _pyarrow()
+    dataset = ds.dataset(source, format='parquet')
+    if columns is not None:
+        columns = [c for c in columns if c in dataset.schema.names]
+    if filters is not None and not isinstance(filters, ds.Expression):
+        filters = pq.filters_to_expression(filters)
+    for batch in dataset.to_batches(columns=columns, filter=filters, batch_size=batch_rows):
+        if batch.num_rows:
+            yield _decode_dictionaries(pa.Table.from_batches([batch])).to_pandas(date_as_object=False)
+
+
+def merge_parquet(files, out_path):
+    """
+    Stream Parquet files into one file batch by batch, so memory does not grow with the dataset.
+
+    :return: Number of rows written
+    """
+    _, ds, pq = _pyarrow()
+    dataset = ds.dataset(files, format='parquet')
+    rows = 0
+    with pq.ParquetWriter(out_path, dataset.schema, compression='zstd', use_dictionary=True) as writer:
+        for batch in dataset.to_batches():
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+class ParquetAppender:
+    """
+    Append frames to one Parquet file, one row group per frame, without holding
+    earlier frames in memory. The schema is fixed by the first frame.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+
+    def write(self, df):
+        _, _, pq = _pyarrow()
+        table = to_arrow(df)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema, compression='zstd', use_dictionary=True)
+        else:
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def list_parquet(path):
+    """Parquet files directly under `path`, sorted."""
+    if not os.path.isdir(path):
+        return []
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.parquet'))
+
+
+def chunk_files(files, n):
+    """Split a file list into `n`-file chunks, so each read covers many small partitions."""
+    return [files[i:i + n] for i in range(0, len(files), n)]
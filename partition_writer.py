@@ -0,0 +1,182 @@
+import hashlib
+import os
+
+import pandas as pd
+
+import parquet_store
+from metrics import metrics
+
+PARTITION_PATH = 'partitions/'
+TABLE_NAMES = ['zyzb', 'zcfzb', 'lrb', 'xjllb']
+STORAGE_FORMATS = ['csv', 'parquet']
+
+
+def hash_frame(df):
+    """
+    Content hash of a DataFrame's values and columns, stable across runs.
+    """
+    h = hashlib.sha1(",".join(map(str, df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class PartitionWriter:
+    """
+    Append-only writer keeping one CSV or Parquet partition per (table, stock).
+
+    Rows go to `{root}/{table}/{stock}.{csv|parquet}.tmp` and are fsynced and renamed into
+    place every `batch_size` stocks, so a crash loses at most the current batch
+    and never leaves a half-written partition behind. Re-scraping a stock
+    replaces its partition instead of duplicating rows.
+
+    With a manifest, a table whose content hash equals the recorded one is not
+    written again; it is still reported to `on_flush` with its batch.
+
+    :param on_flush: Called with the (stock_code, table_name) pairs made durable by each flush
+    :param manifest: CoverageManifest updated with row counts and hashes of flushed partitions
+    :param storage_format: 'csv' or 'parquet' (needs pyarrow)
+    """
+
+    def __init__(self, root=PARTITION_PATH, batch_size=20, on_flush=None, manifest=None, storage_format='csv'):
+        if storage_format not in STORAGE_FORMATS:
+            raise ValueError(f"Unknown storage format: {storage_format}")
+        self.root = root
+        self.storage_format = storage_format
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.manifest = manifest
+        self.unchanged = 0  # tables skipped because their content was already written
+        self._pending = []  # (stock_code, table_name, tmp_path, final_path)
+        self._coverage = []  # (stock_code, table_name, row_count, content_hash)
+        self._unchanged = []  # (stock_code, table_name)
+        self._pending_stocks = 0
+        for table_name in TABLE_NAMES:
+            os.makedirs(os.path.join(root, table_name), exist_ok=True)
+
+    def partition_path(self, table_name, stock_code):
+        return os.path.join(self.root, table_name, f"{stock_code}.{self.storage_format}")
+
+    def write_stock(self, stock_code, tables):
+        """
+        Write the transformed tables of one stock.
+
+        :param stock_code: Stock code
+        :param tables: Dict of table name -> transformed DataFrame
+        """
+        for table_name, df in tables.items():
+            path = self.partition_path(table_name, stock_code)
+            if self.manifest is not None:
+                content_hash = hash_frame(df)
+                if content_hash == self.manifest.content_hash(stock_code, table_name) and os.path.exists(path):
+                    self._unchanged.append((stock_code, table_name))
+                    self.unchanged += 1
+                    continue
+                self._coverage.append((stock_code, table_name, len(df), content_hash))
+            tmp_path = path + ".tmp"
+            with metrics.timer("write_partition"):
+                if self.storage_format == 'parquet':
+                    parquet_store.write_parquet(df, tmp_path)
+                else:
+                    df.to_csv(tmp_path, index=False)
+            self._pending.append((stock_code, table_name, tmp_path, path))
+        self._pending_stocks += 1
+        if self._pending_stocks >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Make every pending partition durable (batch boundary)."""
+        if not self._pending and not self._unchanged:
+            return
+        dirs = set()
+        with metrics.timer("fsync_flush"):
+            for _, _, tmp_path, path in self._pending:
+                _fsync_path(tmp_path)
+                os.replace(tmp_path, path)
+                dirs.add(os.path.dirname(path))
+            for d in dirs:
+                _fsync_path(d)
+        print(f"Flushed {len(self._pending)} partitions for {self._pending_stocks} stocks"
+              + (f", {len(self._unchanged)} unchanged" if self._unchanged else ""))
+        flushed = [(stock_code, table_name) for stock_code, table_name, _, _ in self._pending] + self._unchanged
+        if self.manifest is not None:
+            self.manifest.record(self._coverage)
+        self._pending = []
+        self._coverage = []
+        self._unchanged = []
+        self._pending_stocks = 0
+        if self.on_flush is not None:
+            self.on_flush(flushed)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def list_partitions(root, table_name, storage_format='csv'):
+    table_dir = os.path.join(root, table_name)
+    if not os.path.isdir(table_dir):
+        return []
+    return sorted(os.path.join(table_dir, f) for f in os.listdir(table_dir) if f.endswith(f'.{storage_format}'))
+
+
+def compact(root=PARTITION_PATH, output_path='finance_data/', table_names=TABLE_NAMES, storage_format='csv'):
+    """
+    Merge the partitions of each table into `{output_path}/{table}_compact.{csv|parquet}`,
+    the `{type}_*` layout read by check_stocks and transform_finance_data.
+
+    Partitions are streamed line by line (CSV) or batch by batch (Parquet), so memory
+    does not grow with the dataset.
+
+    :return: Dict of table name -> number of partitions merged
+    """
+    os.makedirs(output_path, exist_ok=True)
+    merged = {}
+    for table_name in table_names:
+        partitions = list_partitions(root, table_name, storage_format)
+        if not partitions:
+            continue
+        out_file = os.path.join(output_path, f"{table_name}_compact.{storage_format}")
+        tmp_file = out_file + ".tmp"
+        if storage_format == 'parquet':
+            parquet_store.merge_parquet(partitions, tmp_file)
+            _fsync_path(tmp_file)
+            os.replace(tmp_file, out_file)
+            merged[table_name] = len(partitions)
+            print(f"Compacted {len(partitions)} partitions into {out_file}")
+            continue
+        header = None
+        with open(tmp_file, "w", encoding="utf-8") as out:
+            for path in partitions:
+                with open(path, "r", encoding="utf-8") as f:
+                    file_header = f.readline()
+                    if header is None:
+                        header = file_header
+                        out.write(header)
+                    elif file_header != header:
+                        raise ValueError(f"Column mismatch in {path}: {file_header.strip()} != {header.strip()}")
+                    for line in f:
+                        out.write(line if line.endswith("\n") else line + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_file, out_file)
+        merged[table_name] = len(partitions)
+        print(f"Compacted {len(partitions)} partitions into {out_file}")
+    return merged
+
+
+if __name__ == "__main__":
+    for storage_format in STORAGE_FORMATS:
+        compact(storage_format=storage_format)
@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from metrics import metrics
+
+PARSE_WORKERS = 2  # processes parsing and transforming fetched pages
+MAX_IN_FLIGHT = 16  # fetched stocks not yet written; fetch workers wait beyond this
+PARSE_ERROR = "Parse error"
+
+_DONE = object()
+
+
+def _process_measured(process_fn, measure, stock_code, payload):
+    """
+    Run `process_fn` in a worker process. Worker processes have their own metrics registry,
+    so with `measure` the timings recorded there are returned with the result, to be merged
+    into the main process's registry.
+
+    :return: (result, drained metrics or None)
+    """
+    if not measure:
+        return process_fn(stock_code, payload), None
+    metrics.enable()
+    metrics.drain()  # anything left by a task that raised
+    return process_fn(stock_code, payload), metrics.drain()
+
+
+class Pipeline:
+    """
+    Scrape in three stages, so a browser or HTTP session never sits idle while pandas runs:
+
+        DriverPool fetch threads -> worker processes (parse + transform) -> one writer thread
+
+    Fetch workers only collect each stock's raw payload and hand it to the process pool.
+    At most `max_in_flight` fetched stocks wait for parsing or writing; beyond that a fetch
+    worker blocks before handing over the next one, so memory stays bounded however far
+    the later stages fall behind.
+
+    :param pool: DriverPool running the fetch stage
+    :param fetch_fn: Callable (fetcher, stock_code) -> (fail_reason, payload), run in the fetch threads
+    :param process_fn: Module-level callable (stock_code, payload) -> result, run in the worker processes;
+        the metrics it records there are merged into this process's registry
+    :param parse_workers: Number of worker processes
+    :param max_in_flight: Fetched stocks allowed between the fetch and the writer stage
+    """
+
+    def __init__(self, pool, fetch_fn, process_fn, parse_workers=PARSE_WORKERS, max_in_flight=MAX_IN_FLIGHT):
+        self.pool = pool
+        self.fetch_fn = fetch_fn
+        self.process_fn = process_fn
+        self.parse_workers = parse_workers
+        self.max_in_flight = max_in_flight
+
+    def run(self, stocks, on_result, on_fail):
+        """
+        Scrape every stock in `stocks`. Both callbacks are called from the writer thread only.
+
+        :param stocks: List or iterator of stock codes (e.g. a job_store.JobFeed)
+        :param on_result: Callable (stock_code, (fail_reason, result)), as with DriverPool.run
+        :param on_fail: Callable (stock_code, fail_reason) for stocks that could not be fetched or parsed
+        """
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        results = queue.Queue()  # (kind, stock_code, value); successes are bounded by `slots`
+        errors = []
+
+        def fetched(stock_code, fetch_result):
+            fail_reason, payload = fetch_result
+            if fail_reason:
+                results.put(("result", stock_code, (fail_reason, {})))
+                return
+            with metrics.timer("backpressure_wait"):
+                slots.acquire()
+            start = time.perf_counter()
+            try:
+                future = processes.submit(_process_measured, self.process_fn, metrics.enabled, stock_code, payload)
+            except Exception as e:
+                # e.g. BrokenProcessPool after a worker process died: fail the stock, keep the fetch thread
+                print(f"[!!!] Error submitting {stock_code}: {type(e).__name__}: {e}")
+                metrics.incr("parse_errors")
+                slots.release()
+                results.put(("fail", stock_code, PARSE_ERROR))
+                return
+
+            def done(f):
+                metrics.observe("stage_seconds", time.perf_counter() - start, stage="process")
+                results.put(("processed", stock_code, f))
+
+            future.add_done_callback(done)
+
+        def write():
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    return
+                kind, stock_code, value = item
+                try:
+                    if kind == "fail":
+                        on_fail(stock_code, value)
+                    elif kind == "result":
+                        on_result(stock_code, value)
+                    else:
+                        try:
+                            result, recorded = value.result()
+                        except Exception as e:
+                            print(f"[!!!] Error processing {stock_code}: {type(e).__name__}: {e}")
+                            metrics.incr("parse_errors")
+                            on_fail(stock_code, PARSE_ERROR)
+                        else:
+                            if recorded is not None:
+                                metrics.merge(recorded)
+                            on_result(stock_code, (None, result))
+                except Exception as e:
+                    # keep draining, or fetch workers waiting for a slot would never wake up
+                    print(f"[!!!] Error writing {stock_code}: {type(e).__name__}: {e}")
+                    errors.append(e)
+                finally:
+                    if kind == "processed":
+                        slots.release()
+
+        writer = threading.Thread(target=write, name="pipeline-writer")
+        writer.start()
+        try:
+            # spawn: forking a process that runs driver and server threads can copy held locks
+            with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=get_context("spawn")) as processes:
+                self.pool.run(stocks, self.fetch_fn, fetched,
+                              lambda stock_code, fail_reason: results.put(("fail", stock_code, fail_reason)))
+        finally:
+            results.put(_DONE)  # after the executor has finished, so every result is queued
+            writer.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,206 @@
+import json
+import os
+import random
+import threading
+import time
+
+PROXY_POOL_PATH = "proxy_pool.json"
+
+
+class ProxyStats:
+    """
+    Health of one proxy: EWMA of latency and success rate plus a circuit breaker.
+    """
+
+    def __init__(self, proxy, latency=None, success=1.0):
+        self.proxy = proxy
+        self.latency = latency  # EWMA seconds, None until first measured
+        self.success = success  # EWMA of 1/0 outcomes
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # breaker is open (proxy unusable) until this time
+        self.cooldown = 0.0
+
+    def score(self, default_latency):
+        latency = self.latency if self.latency is not None else default_latency
+        return max(self.success, 0.01) / max(latency, 0.1)
+
+    def to_dict(self):
+        return {"proxy": self.proxy, "latency": self.latency, "success": self.success,
+                "consecutive_failures": self.consecutive_failures, "open_until": self.open_until,
+                "cooldown": self.cooldown}
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls(d["proxy"], d.get("latency"), d.get("success", 1.0))
+        stats.consecutive_failures = d.get("consecutive_failures", 0)
+        stats.open_until = d.get("open_until", 0.0)
+        stats.cooldown = d.get("cooldown", 0.0)
+        return stats
+
+
+class ProxyPool:
+    """
+    Thread-safe, scored proxy pool shared by the scraper and check_proxies.
+
+    Proxies are picked at random weighted by success rate / latency. After
+    `failure_threshold` consecutive failures a proxy's breaker opens for
+    `cooldown` seconds (doubling on every failure while half-open, up to
+    `max_cooldown`); afterwards it gets one trial request.
+
+    :param proxies: Proxies ("ip:port" or "user:pass@ip:port")
+    :param alpha: EWMA smoothing factor
+    """
+
+    def __init__(self, proxies, alpha=0.3, failure_threshold=3, cooldown=300, max_cooldown=3600):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._stats = {p: ProxyStats(p) for p in dict.fromkeys(proxies)}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._stats)
+
+    @property
+    def proxies(self):
+        return list(self._stats)
+
+    def add(self, proxies):
+        with self._lock:
+            for p in proxies:
+                self._stats.setdefault(p, ProxyStats(p))
+
+    def remove(self, proxies):
+        with self._lock:
+            for p in proxies:
+                self._stats.pop(p, None)
+
+    def healthy(self):
+        now = time.time()
+        with self._lock:
+            return [s.proxy for s in self._stats.values() if s.open_until <= now]
+
+    def choose(self, exclude=()):
+        """
+        Pick a proxy by weighted score among proxies whose breaker is closed.
+        If every breaker is open, return the one that reopens first.
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [s for s in self._stats.values() if s.proxy not in exclude] or list(self._stats.values())
+            available = [s for s in candidates if s.open_until <= now]
+            if not available:
+                return min(candidates, key=lambda s: s.open_until).proxy
+            latencies = [s.latency for s in available if s.latency is not None]
+            default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+            weights = [s.score(default_latency) for s in available]
+            return random.choices(available, weights=weights)[0].proxy
+
+    def report(self, proxy, ok, latency=None):
+        """Record the outcome of one request through `proxy`."""
+        with self._lock:
+            stats = self._stats.get(proxy)
+            if stats is None:
+                return
+            a = self.alpha
+            stats.success = (1 - a) * stats.success + a * (1.0 if ok else 0.0)
+            if ok:
+                if latency is not None:
+                    stats.latency = latency if stats.latency is None else (1 - a) * stats.latency + a * latency
+                stats.consecutive_failures = 0
+                stats.open_until = 0.0
+                stats.cooldown = 0.0
+                return
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.failure_threshold:
+                self._open(stats)
+
+    def _open(self, stats):
+        stats.cooldown = min(self.max_cooldown, stats.cooldown * 2 if stats.cooldown else self.base_cooldown)
+        stats.open_until = time.time() + stats.cooldown
+
+    def trip(self, proxy):
+        """Record a failure and open `proxy`'s breaker at once, e.g. when it failed validation."""
+        with self._lock:
+            stats = self._stats.get(proxy)
+            if stats is None:
+                return
+            stats.success = (1 - self.alpha) * stats.success
+            stats.consecutive_failures = max(stats.consecutive_failures + 1, self.failure_threshold)
+            self._open(stats)
+
+    def ranked(self):
+        """
+        :return: List of (proxy, score) for healthy proxies, best first
+        """
+        now = time.time()
+        with self._lock:
+            available = [s for s in self._stats.values() if s.open_until <= now]
+            latencies = [s.latency for s in available if s.latency is not None]
+            default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+            scored = [(s.proxy, s.score(default_latency)) for s in available]
+        return sorted(scored, key=lambda x: x[1], reverse=True)
+
+    def revalidate(self, validate_fn=None):
+        """
+        Re-check every proxy once and feed the results into the pool. A proxy that fails
+        the check has its breaker opened, so it is not picked until it passes again.
+
+        :param validate_fn: Callable (proxy_list) -> (good, bad) in check_proxies.validate_proxies format
+        """
+        if validate_fn is None:
+            from check_proxies import validate_proxies as validate_fn
+        good, bad = validate_fn(self.proxies)
+        for res in good:
+            self.report(res["proxy"], True, res["latency"])
+        for res in bad:
+            self.trip(res["proxy"])
+        return good, bad
+
+    def start_revalidation(self, interval=600, validate_fn=None, path=None):
+        """
+        Revalidate in a background thread every `interval` seconds, saving to `path` if given.
+        """
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    good, bad = self.revalidate(validate_fn)
+                    print(f"Proxy pool revalidated - healthy: {len(self.healthy())}, passed: {len(good)}, failed: {len(bad)}")
+                    if path:
+                        self.save(path)
+                except Exception as e:
+                    print(f"Error revalidating proxies: {type(e).__name__}: {e}")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, daemon=True, name="proxy-revalidation")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def save(self, path=PROXY_POOL_PATH):
+        with self._lock:
+            state = [s.to_dict() for s in self._stats.values()]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=PROXY_POOL_PATH, **kwargs):
+        """
+        Load a pool saved with `save`, or a plain proxy list (one per line) such as valid_proxies.txt.
+        """
+        with open(path, "r") as f:
+            if path.endswith(".json"):
+                state = json.load(f)
+                pool = cls([d["proxy"] for d in state], **kwargs)
+                pool._stats = {d["proxy"]: ProxyStats.from_dict(d) for d in state}
+                return pool
+            return cls([line.strip() for line in f if line.strip()], **kwargs)
@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+
+# Request rates are stocks (one F10 page or its four API calls) per second
+GLOBAL_RATE = 2.0  # starting rate across all workers
+GLOBAL_MAX_RATE = 10.0
+PROXY_RATE = 0.5  # starting rate per proxy
+PROXY_MAX_RATE = 2.0
+MIN_RATE = 0.05
+RATE_INCREASE = 0.1  # additive increase per success
+PROXY_DECREASE = 0.7  # multiplicative decrease of a proxy's rate per failure
+GLOBAL_DECREASE = 0.9  # gentler, one bad proxy should not slow every worker down
+BACKOFF_BASE = 2.0  # seconds, doubled per consecutive failure of a proxy
+BACKOFF_MAX = 120.0
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most `burst` tokens.
+    """
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        """
+        Take one token, going into debt if there is none.
+
+        :return: Seconds to wait before the token may be used
+        """
+        self._refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def set_rate(self, rate, now):
+        self._refill(now)  # tokens earned so far count at the old rate
+        self.rate = rate
+
+
+class RateLimiter:
+    """
+    Pace requests with one token bucket per proxy and one shared by all of them, and
+    adapt both rates to how the target responds (AIMD): every success adds RATE_INCREASE,
+    every failure (error, timeout, empty page) multiplies the rate down. A failing proxy
+    is also blocked for a jittered, exponentially growing backoff; successes never wait
+    longer than their buckets require.
+
+    Thread-safe; share one instance between the workers of a DriverPool.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, proxy_rate=PROXY_RATE, global_max_rate=GLOBAL_MAX_RATE,
+                 proxy_max_rate=PROXY_MAX_RATE, min_rate=MIN_RATE, increase=RATE_INCREASE,
+                 proxy_decrease=PROXY_DECREASE, global_decrease=GLOBAL_DECREASE,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.proxy_rate = proxy_rate
+        self.global_max_rate = global_max_rate
+        self.proxy_max_rate = proxy_max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.proxy_decrease = proxy_decrease
+        self.global_decrease = global_decrease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._global = TokenBucket(global_rate)
+        self._proxies = {}  # proxy -> TokenBucket
+        self._failures = {}  # proxy -> consecutive failures
+
+    def _bucket(self, proxy):
+        bucket = self._proxies.get(proxy)
+        if bucket is None:
+            bucket = self._proxies[proxy] = TokenBucket(self.proxy_rate)
+        return bucket
+
+    def reserve(self, proxy):
+        """
+        Reserve the next request through `proxy`.
+
+        :return: Seconds the caller must wait before sending it
+        """
+        with self._lock:
+            now = time.monotonic()
+            return max(self._bucket(proxy).reserve(now), self._global.reserve(now))
+
+    def acquire(self, proxy):
+        """
+        Block until a request through `proxy` is allowed.
+
+        :return: Seconds waited
+        """
+        wait = self.reserve(proxy)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def success(self, proxy):
+        with self._lock:
+            now = time.monotonic()
+            self._failures.pop(proxy, None)
+            bucket = self._bucket(proxy)
+            bucket.set_rate(min(self.proxy_max_rate, bucket.rate + self.increase), now)
+            self._global.set_rate(min(self.global_max_rate, self._global.rate + self.increase), now)
+
+    def failure(self, proxy):
+        """
+        Slow down after an error, timeout or empty page through `proxy`.
+
+        :return: Backoff in seconds before `proxy` is used again
+        """
+        with self._lock:
+            now = time.monotonic()
+            failures = self._failures.get(proxy, 0) + 1
+            self._failures[proxy] = failures
+            bucket = self._bucket(proxy)
+            bucket.set_rate(max(self.min_rate, bucket.rate * self.proxy_decrease), now)
+            self._global.set_rate(max(self.min_rate, self._global.rate * self.global_decrease), now)
+            # full jitter: workers that failed together do not retry together
+            backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (failures - 1)))
+            bucket.blocked_until = max(bucket.blocked_until, now + backoff)
+            return backoff
+
+    def rates(self):
+        """
+        :return: (global rate, dict of proxy -> rate) in requests per second
+        """
+        with self._lock:
+            return self._global.rate, {proxy: bucket.rate for proxy, bucket in self._proxies.items()}
+
+    def summary(self):
+        global_rate, proxy_rates = self.rates()
+        if not proxy_rates:
+            return f"Rate limit: {global_rate:.2f}/s global"
+        slowest = min(proxy_rates.values())
+        return (f"Rate limit: {global_rate:.2f}/s global, {len(proxy_rates)} proxies at "
+                f"{slowest:.2f}-{max(proxy_rates.values()):.2f}/s")
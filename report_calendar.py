@@ -0,0 +1,125 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+STOCK_DATE_PATH = 'transformed_finance_data/stock_date_df.csv'
+
+# HKEX Main Board deadlines: interim results within 2 months of the period end, annual within 3
+INTERIM_DEADLINE_MONTHS = 2
+ANNUAL_DEADLINE_MONTHS = 3
+EARLIEST_REPORT_DAYS = 20  # results are rarely out sooner than this after the period end
+GRACE_DAYS = 14  # East Money lag and late filers
+DUE_RECHECK_DAYS = 3  # how often to re-scrape a stock inside its reporting window
+OVERDUE_RECHECK_DAYS = 14  # how often to re-scrape a stock whose report is past due (suspended, late)
+
+# Job store priorities, higher is claimed first
+PRIORITY_NEW = 3  # never scraped
+PRIORITY_DUE = 2
+PRIORITY_OVERDUE = 1
+
+# Schedule statuses
+NEW = "new"
+FRESH = "fresh"
+DUE = "due"
+OVERDUE = "overdue"
+
+
+def load_stock_dates(path=STOCK_DATE_PATH):
+    """
+    Read stock_date_df written by transform_finance_data.
+
+    :return: DataFrame with 股票代码, 最新报表截止日, 年结月, or None if it has not been built yet
+    """
+    if not os.path.exists(path):
+        return None
+    date_df = pd.read_csv(path, dtype={'股票代码': str})
+    date_df['最新报表截止日'] = pd.to_datetime(date_df['最新报表截止日'], errors='coerce')
+    date_df['年结月'] = date_df['年结月'].astype(pd.Int64Dtype())
+    return date_df
+
+
+def _month_end(dates, months):
+    return (dates.dt.to_period('M') + months).dt.to_timestamp(how='end').dt.normalize()
+
+
+def build_schedule(date_df, stock_list, last_checked=None, today=None):
+    """
+    Predict each stock's next report from its latest report date and fiscal year end month,
+    and decide whether it is worth scraping today.
+
+    The next period ends 6 months after the latest one; it is an annual report when that
+    month is the 年结月. A stock is "fresh" before its reporting window opens, "due" inside
+    it and "overdue" after the deadline. Stocks missing from date_df are "new".
+
+    :param date_df: Output of load_stock_dates
+    :param stock_list: Stock codes to schedule
+    :param last_checked: Dict of stock code -> epoch seconds of the last completed scrape
+    :param today: Date to schedule for, defaults to today
+    :return: DataFrame indexed like stock_list with status, scrape flag and priority per stock
+    """
+    today = pd.Timestamp(today or datetime.date.today())
+    last_checked = last_checked or {}
+
+    schedule = pd.DataFrame({'股票代码': pd.Series(stock_list, dtype=str)})
+    schedule = pd.merge(schedule, date_df[['股票代码', '最新报表截止日', '年结月']].drop_duplicates('股票代码'),
+                        on='股票代码', how='left')
+
+    next_end = _month_end(schedule['最新报表截止日'], 6)
+    schedule['下期截止日'] = next_end
+    schedule['是否年报'] = (next_end.dt.month == schedule['年结月']).fillna(False).astype(int)
+    schedule['window_start'] = next_end + pd.Timedelta(days=EARLIEST_REPORT_DAYS)
+    schedule['deadline'] = pd.Series(np.where(
+        schedule['是否年报'] == 1,
+        _month_end(schedule['最新报表截止日'], 6 + ANNUAL_DEADLINE_MONTHS),
+        _month_end(schedule['最新报表截止日'], 6 + INTERIM_DEADLINE_MONTHS))) + pd.Timedelta(days=GRACE_DAYS)
+
+    schedule['status'] = np.select(
+        [schedule['最新报表截止日'].isna(), today < schedule['window_start'], today <= schedule['deadline']],
+        [NEW, FRESH, DUE], default=OVERDUE)
+
+    checked = pd.to_datetime(schedule['股票代码'].map(last_checked), unit='s')
+    schedule['last_checked'] = checked.dt.normalize()
+    days_since = (today - schedule['last_checked']).dt.days
+    # a check made before the window opened says nothing about the new report
+    stale = checked.isna() | (schedule['last_checked'] < schedule['window_start'])
+    schedule['scrape'] = np.select(
+        [schedule['status'] == NEW,
+         schedule['status'] == DUE,
+         schedule['status'] == OVERDUE],
+        [True,
+         stale | (days_since >= DUE_RECHECK_DAYS),
+         stale | (days_since >= OVERDUE_RECHECK_DAYS)],
+        default=False)
+    schedule['priority'] = schedule['status'].map(
+        {NEW: PRIORITY_NEW, DUE: PRIORITY_DUE, OVERDUE: PRIORITY_OVERDUE, FRESH: 0})
+    return schedule
+
+
+def stocks_to_scrape(schedule):
+    """
+    :return: Dict of priority -> stock codes to scrape, most urgent deadline first
+    """
+    todo = schedule[schedule['scrape']].sort_values(['priority', 'deadline'], ascending=[False, True])
+    return {int(priority): group['股票代码'].tolist() for priority, group in todo.groupby('priority', sort=False)}
+
+
+def summarize(schedule):
+    counts = schedule.groupby('status')['scrape'].agg(['size', 'sum'])
+    return ", ".join(f"{status} {int(row['sum'])}/{int(row['size'])}" for status, row in counts.iterrows())
+
+
+if __name__ == "__main__":
+    from job_store import JobStore, JOB_STORE_PATH
+
+    stock_code_df = pd.read_csv("hk_stock_list_short.csv", dtype={"股份代號": str})
+    date_df = load_stock_dates()
+    if date_df is None:
+        print(f"{STOCK_DATE_PATH} not found, run transform_finance_data.py first.")
+    else:
+        store = JobStore(JOB_STORE_PATH)
+        schedule = build_schedule(date_df, stock_code_df["股份代號"].tolist(), store.last_checked())
+        print("Stocks to scrape (status scrape/total):", summarize(schedule))
+        for priority, stocks in stocks_to_scrape(schedule).items():
+            print(f"Priority {priority}: {len(stocks)} stocks, e.g. {stocks[:10]}")
@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES_PATH = 'fixtures/'
+F10_PATH = "/PC_HKF10/pages/home/index.html"  # ?code=<stock code> replays that stock's recorded F10 page
+
+# Recorded pages, by request path, relative to the fixtures dir
+PAGE_FIXTURES = {
+    "/stocklist_active_main_c.htm": "hkex/stocklist_active_main_c.htm",  # HKEX stock list
+    F10_PATH: "pages/NewFinancialAnalysis.html",  # F10 page shell, without a code (check_proxies TEST_URL)
+}
+# What the F10 page shows for codes without data
+EMPTY_PAGE = '<html><body><div id="app"><div class="empty">暂无数据</div></div></body></html>'
+_RE_SCRIPT = re.compile(r"<script\b.*?</script>", re.S | re.I)
+
+
+def page_fixture_path(fixtures_dir, stock_code):
+    return os.path.join(fixtures_dir, "pages", "f10", f"{stock_code}.html")
+
+
+def save_page(fixtures_dir, stock_code, html):
+    """
+    Save a rendered F10 page as a fixture. Scripts are dropped, so the replayed page
+    keeps the recorded tables instead of loading them again.
+    """
+    path = page_fixture_path(fixtures_dir, stock_code)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(_RE_SCRIPT.sub("", html))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serve recorded responses from `server.fixtures_dir`."""
+
+    def do_GET(self):
+        if self.server.latency or self.server.jitter:
+            time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+        if self.server.failure_rate and random.random() < self.server.failure_rate:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        parts = urlsplit(self.path)
+        body = self.server.route(parts.path, parse_qs(parts.query))
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        content_type = "text/html" if parts.path.endswith((".htm", ".html")) else "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    :param latency: Seconds added to every response
+    :param jitter: Up to this many more seconds, uniformly at random
+    :param failure_rate: Share of requests answered with 503
+    """
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, fixtures_dir=FIXTURES_PATH, latency=0.0, jitter=0.0, failure_rate=0.0):
+        super().__init__(address, StubHandler)
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    def route(self, path, query):
+        """
+        :return: Response body for a request, or None for 404
+        """
+        if path == F10_PATH and "code" in query:
+            try:
+                with open(page_fixture_path(self.fixtures_dir, query["code"][0]), "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return EMPTY_PAGE.encode("utf-8")
+        if path in PAGE_FIXTURES:
+            try:
+                with open(os.path.join(self.fixtures_dir, PAGE_FIXTURES[path]), "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+        return None
+
+
+def start_stub_server(fixtures_dir=FIXTURES_PATH, host="127.0.0.1", port=0, **injection):
+    """
+    Start a stub server in a background thread.
+
+    :param injection: latency, jitter and failure_rate, see StubServer
+    :return: (server, base_url); call `server.shutdown()` to stop it
+    """
+    server = StubServer((host, port), fixtures_dir, **injection)
+    threading.Thread(target=server.serve_forever, daemon=True, name="stub-server").start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+class StubProxy:
+    """
+    Local HTTP proxy whose behaviour is picked by the proxy username, so one port
+    can stand in for thousands of proxies ("<behaviour>-<n>:x@127.0.0.1:port"):
+
+    - ok: answers 200 at once
+    - slow<ms>: answers 200 after <ms> milliseconds
+    - flaky<pct>: drops <pct>% of connections without answering
+    - dead: closes the connection
+    - hang: never answers
+
+    Only absolute-form GET requests (http:// targets) are served.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._server = None
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, backlog=8192))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True, name="stub-proxy").start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        async def shutdown():
+            self._server.close()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop)
+
+    def proxy(self, behaviour, n=0):
+        return f"{behaviour}-{n}:x@{self.host}:{self.port}"
+
+    async def _handle(self, reader, writer):
+        try:
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                headers.append(line.decode("latin-1"))
+            behaviour = "ok"
+            for h in headers:
+                if h.lower().startswith("proxy-authorization:"):
+                    user = base64.b64decode(h.split()[-1]).decode().split(":")[0]
+                    behaviour = user.split("-")[0]
+            if behaviour == "hang":
+                await reader.read()  # until the client gives up
+                return
+            if behaviour == "dead" or (behaviour.startswith("flaky") and random.random() * 100 < int(behaviour[5:])):
+                return
+            if behaviour.startswith("slow"):
+                await asyncio.sleep(int(behaviour[4:]) / 1000)
+            status = "405 Method Not Allowed" if headers and headers[0].startswith("CONNECT") else "200 OK"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok".encode())
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+if __name__ == "__main__":
+    server = StubServer(("127.0.0.1", 8765))
+    print(f"Serving fixtures on http://127.0.0.1:8765/ (F10 pages on http://127.0.0.1:8765{F10_PATH})")
+    server.serve_forever()
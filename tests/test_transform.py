@@ -0,0 +1,76 @@
+import random
+
+import pandas as pd
+import pytest
+
+import transform_data_for_scraper as tdfs
+import transform_finance_data as tfd
+from bench_transform import add_prefixes_loop, make_statement, make_values, parse_values_legacy
+
+
+def statement(rows):
+    return pd.DataFrame(rows, columns=['截止日期', '24-12-31', '24-06-30'])
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_add_prefixes_matches_loop(seed):
+    rng = random.Random(seed)
+    df = make_statement(rng.randint(0, 60), n_dates=rng.randint(1, 6), seed=seed)
+    expected = add_prefixes_loop(df.copy())
+    pd.testing.assert_frame_equal(tdfs.add_prefixes(df.copy()), expected, check_dtype=False)
+
+
+def test_add_prefixes_groups():
+    df = statement([
+        ['年结日', '12-31', '12-31'],
+        ['流动资产', '流动资产', '流动资产'],  # header row, dropped
+        ['现金', '1亿', '2亿'],
+        ['存货', '3亿', '4亿'],
+        ['流动资产总额', '4亿', '6亿'],  # 总额 closes the group
+        ['商誉', '5亿', '5亿'],
+        ['负债', '负债', '负债'],
+        ['借款', '1万', '2万'],
+        ['负债', '--', '--'],  # repeating the header name closes the group too
+        ['股本', '1', '1'],
+    ])
+    out = tdfs.add_prefixes(df)
+    assert out['截止日期'].tolist() == ['年结日', '流动资产_现金', '流动资产_存货', '流动资产总额', '商誉',
+                                      '负债_借款', '负债', '股本']
+    assert out['24-12-31'].tolist() == ['12-31', '1亿', '3亿', '4亿', '5亿', '1万', '--', '1']
+
+
+def test_add_prefixes_empty_and_headers_only():
+    empty = statement([])
+    pd.testing.assert_frame_equal(tdfs.add_prefixes(empty.copy()), add_prefixes_loop(empty.copy()), check_dtype=False)
+    assert tdfs.add_prefixes(statement([['资产', '资产', '资产'], ['负债', '负债', '负债']])).empty
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_parse_value_units_matches_per_row_parser(seed):
+    df = make_values(5000, seed=seed)
+    expected = parse_values_legacy(df.copy())
+    value, unit = tfd.parse_value_units(df['数值'])
+    pd.testing.assert_series_equal(value, expected['value'], check_names=False)
+    pd.testing.assert_series_equal(unit.astype(str), expected['unit'], check_names=False)
+
+
+def test_parse_value_units_scales_by_unit():
+    values = pd.Series(['1.5亿', '-2万', '3万亿', '4.25', '--', '', '7元'], index=list('abcdefg'))
+    value, unit = tfd.parse_value_units(values)
+    assert value.index.tolist() == list('abcdefg')
+    assert value.tolist()[:4] == [1.5e8, -2e4, 3e12, 4.25]
+    assert value[['e', 'f']].isna().all()
+    assert value['g'] == 7
+    assert unit.tolist() == ['亿', '万', '万亿', '', '', '', '元']
+
+
+def test_parse_value_units_extra_units():
+    units = dict(tfd.UNIT_MULTIPLIERS, **{'%': 0.01, '千': 1000})
+    value, unit = tfd.parse_value_units(pd.Series(['12.5%', '3千', '1亿']), units)
+    assert value.tolist() == pytest.approx([0.125, 3000, 1e8])
+    assert unit.tolist() == ['%', '千', '亿']
+
+
+def test_parse_value_units_empty():
+    value, unit = tfd.parse_value_units(pd.Series([], dtype=object))
+    assert value.empty and unit.empty
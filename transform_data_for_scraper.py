@@ -18,28 +18,34 @@ def add_prefixes(df):
     """
     Add prefixes to the first column of the dataframe based on hierarchical structure.
 
+    A row whose value equals its name is a group header: it is dropped and the
+    rows after it get "{header}_" prefixed, until a row repeating the header
+    name or containing '总额' closes the group.
+
     :param df: Input DataFrame
     :return: DataFrame with updated first column
     """
-    prefix = ''
-    drop_i = []
-
-    for i in range(len(df)):
-        col = df.iloc[i, 0]
-        val = df.iloc[i, 1]
-        if val == col:
-            prefix = col
-            drop_i.append(i)
-            continue
-
-        elif (col == prefix) or ('总额' in col):
-            prefix = ''
-
-        if prefix != '':
-            df.iloc[i, 0] = f"{prefix}_{col}"
-
-    keep_i = [i for i in range(len(df)) if i not in drop_i]
-    df = df.iloc[keep_i].reset_index(drop=True)
+    col = df.iloc[:, 0]
+    is_header = (df.iloc[:, 1] == col).to_numpy()
+    names = col.to_numpy(dtype=object).copy()
+
+    # position of the latest header at or before each row (-1 before the first one)
+    positions = np.arange(len(names))
+    last_header = np.maximum.accumulate(np.where(is_header, positions, -1)) if len(names) else positions
+    in_group = last_header >= 0
+    header_name = np.where(in_group, names[last_header], None)
+
+    # a group is closed from the first row repeating its header or containing '总额'
+    closes = ~is_header & ((names == header_name) | col.astype(str).str.contains('总额', regex=False).to_numpy())
+    closes_so_far = np.cumsum(closes)
+    closed = closes_so_far - np.where(in_group, closes_so_far[last_header], 0) > 0
+    prefixed = in_group & ~is_header & ~closed
+
+    names[prefixed] = header_name[prefixed] + '_' + names[prefixed]
+
+    keep = ~is_header
+    df = df.iloc[keep].reset_index(drop=True)
+    df.iloc[:, 0] = names[keep]
     return df
 
 
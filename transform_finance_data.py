@@ -3,21 +3,75 @@ import numpy as np
 import transform_stock_code as tsc
 import re
 import os
+import pickle
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import parquet_store
+import derived_flags
 
 def output_date_df(df, content_name='lrb'):
     df = tsc.transform_stock_code(df, '股票代码')
-    df['年结月'] = df['年结日'].astype(str).str.split('-').str[0].astype(pd.Int64Dtype())
-    df_1 = df[['股票代码', '年结月']].drop_duplicates()
-    df_2 = df.groupby('股票代码')['报表截止日'].max().reset_index()
-    date_df = pd.merge(df_2, df_1, on='股票代码', how='left')
-    date_df.rename(columns={'报表截止日': '最新报表截止日'}, inplace=True)
-    return date_df
+    return derived_flags.date_table(df)
+
+
+# Regex pattern for Chinese characters (CJK Unified Ideographs range)
+CHINESE_PATTERN = re.compile(r'[\u4E00-\u9FFF]+') # '+' matches one or more consecutive Chinese chars
+
+# Multiplier for each unit suffix of 数值; add e.g. '千': 1e3 or '%': 0.01 to parse more units
+UNIT_MULTIPLIERS = {'万亿': 1000000000000, '亿': 100000000, '万': 10000}
 
 
 def extract_chinese(text):
-    # Regex pattern for Chinese characters (CJK Unified Ideographs range)
-    chinese_pattern = re.compile(r'[\u4E00-\u9FFF]+') # '+' matches one or more consecutive Chinese chars
-    return "".join(chinese_pattern.findall(text)) # Joins the list of found characters into a single string
+    return "".join(CHINESE_PATTERN.findall(text)) # Joins the list of found characters into a single string
+
+
+def _unit_code_points(unit_multipliers):
+    # code points counted as unit chars besides Chinese ones, e.g. '%'
+    return sorted({ord(ch) for unit in unit_multipliers for ch in unit if not CHINESE_PATTERN.fullmatch(ch)})
+
+
+def _compact(code_points, keep, width):
+    """Keep the `keep` chars of each row of a UTF-32 code point matrix, in order, as a string array."""
+    order = np.argsort(~keep, axis=1, kind='stable')
+    kept = np.take_along_axis(np.where(keep, code_points, 0), order, axis=1)
+    return np.ascontiguousarray(kept).view(f'<U{width}').ravel()
+
+
+def parse_value_units(values, unit_multipliers=UNIT_MULTIPLIERS):
+    """
+    Split 数值 strings such as '1.23亿' into a number and its unit, scaled by
+    `unit_multipliers` through a categorical lookup.
+
+    All strings are viewed as one fixed-width UTF-32 code point matrix, so the
+    Chinese unit chars are found for every row at once instead of with a regex
+    per row. As before, the unit is every Chinese char and the value is the rest.
+
+    :param values: Series of 数值
+    :return: (value, unit) Series
+    """
+    text = values.to_numpy(dtype=str)
+    width = text.dtype.itemsize // 4
+    unit = np.full(len(text), '', dtype=f'<U{max(width, 1)}')
+    value_text = text.copy()
+    if width:
+        code_points = text.view(np.uint32).reshape(len(text), width)
+        in_unit = (code_points >= 0x4E00) & (code_points <= 0x9FFF)
+        for cp in _unit_code_points(unit_multipliers):
+            in_unit |= code_points == cp
+        has_unit = in_unit.any(axis=1)
+        if has_unit.any():
+            rows, keep = code_points[has_unit], in_unit[has_unit]
+            unit[has_unit] = _compact(rows, keep, width)
+            value_text[has_unit] = _compact(rows, ~keep & (rows != 0), width)
+
+    unit = pd.Categorical(unit)
+    value = pd.Series(pd.to_numeric(value_text, errors='coerce'), index=values.index)
+    multipliers = unit.categories.map(lambda u: unit_multipliers.get(u, 1)).to_numpy()
+    if (multipliers != 1).any():
+        value = value * multipliers[unit.codes]
+    return value, pd.Series(unit, index=values.index)
 
 
 def clean_df(df, content_name):
@@ -33,74 +87,335 @@ def clean_df(df, content_name):
     # 处理日期相关字段
     if content_name in ['zcfzb', 'zyzb']:
         df.rename(columns={'截止日期': '报表截止日'}, inplace=True)
-    df['报表截止日'] = pd.to_datetime('20'+ df['报表截止日'].astype(str), errors='coerce').dt.date
-    df['报表月'] = pd.to_datetime(df['报表截止日']).dt.month.astype(pd.Int64Dtype())
+    df['报表截止日'] = derived_flags.report_dates(df['报表截止日'])
+    df['报表月'] = derived_flags.report_month(df['报表截止日'])
     if '年结日' in df.columns:
-        df['年结月'] = df['年结日'].astype(str).str.split('-').str[0].astype(pd.Int64Dtype())
+        df['年结月'] = derived_flags.year_end_month(df['年结日'])
         df['是否年报'] = np.where(df['报表月'] == df['年结月'], 1, 0)
 
     # 处理数值和单位
     val_col = '数值'
-    # Apply the function to the 'val_col' to create a new column with only Chinese characters
-    df['unit'] = df[val_col].apply(extract_chinese)
-    df['value'] = df[val_col].str.replace(r'[\u4E00-\u9FFF]+', '', regex=True)
-    df['value'] = pd.to_numeric(df['value'], errors='coerce')
-    df.loc[df['unit']=='万亿', 'value'] = df['value'] * 1000000000000
-    df.loc[df['unit']=='亿', 'value'] = df['value'] * 100000000
-    df.loc[df['unit']=='万', 'value'] = df['value'] * 10000
+    value, unit = parse_value_units(df[val_col])
+    df['unit'] = unit
+    df['value'] = value
 
     # 指标组,指标名称 排序
-    index_name_df = df[['指标组', '指标名称']].drop_duplicates().reset_index(drop=True).reset_index().rename(columns={'index': 'order_index'})
-    output_df = pd.merge(df, index_name_df, on=['指标组', '指标名称'], how='left')
+    df['order_index'] = derived_flags.order_index(df)
 
-    return output_df
+    return df.reset_index(drop=True)
 
 
-if __name__ == "__main__":
-    input_path = 'finance_data/'
-    output_path = 'transformed_finance_data/'
+OUTPUT_COLUMNS = ['股票代码', '股份簡稱', '报表截止日', '年结月', '是否年报', '是否最新报表','指标组', '指标名称', '币种', '数值', 'value', 'order_index']
+FILE_TYPE_LIST = ['lrb', 'zcfzb', 'xjllb', 'zyzb']
+# Raw columns clean_df uses; Parquet inputs load only these
+RAW_COLUMNS = ['报表截止日', '截止日期', '年结日', '数值', '指标组', '指标名称', '股票代码', '币种']
+DATE_COLUMNS = ['股票代码', '报表截止日', '年结日']  # what output_date_df needs from lrb
+PARTITION_CHUNK_SIZE = 200  # per-stock partitions read by one worker task
+STREAM_CHUNK_ROWS = 200_000  # raw rows read at a time by run_streaming
+ORDER_COLUMNS = ['指标组', '指标名称']
+VERSION_FILE = '_version'  # rewritten after every run, once all outputs are written (see finance_query)
 
-    stock_df = pd.read_csv('hk_stock_list_short.csv', dtype={"股份代號": str})
 
-    # sort out file_type and files
-    file_name_list = os.listdir(input_path)
-    file_type_list = ['lrb', 'zcfzb', 'xjllb', 'zyzb']
-    file_dict = {file_type: [] for file_type in file_type_list}
-    for file_name in file_name_list:
+def read_raw(source, columns=None, stock_codes=None):
+    """
+    Read raw scraper output: a CSV file, a Parquet file, or a list of partition files.
+
+    Parquet is read with column pruning and the stock filter pushed down to the reader.
+
+    :param stock_codes: Only keep these stocks (5-digit codes), None for all
+    """
+    sources = source if isinstance(source, list) else [source]
+    if sources and sources[0].endswith('.parquet'):
+        return parquet_store.read_parquet(sources, columns=columns, filters=_stock_filter(stock_codes))
+    usecols = (lambda c: c in columns) if columns is not None else None
+    frames = [pd.read_csv(f, usecols=usecols) for f in sources]
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    return _select(df, columns, stock_codes)
+
+
+def _stock_filter(stock_codes):
+    return [('股票代码', 'in', list(stock_codes))] if stock_codes is not None else None
+
+
+def _select(df, columns, stock_codes):
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    if stock_codes is not None:
+        df = df[tsc.transform_stock_code(df[['股票代码']].copy(), '股票代码')['股票代码'].isin(stock_codes)]
+    return df
+
+
+def iter_raw(source, columns=None, stock_codes=None, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Like read_raw, as frames of at most `chunk_rows` raw rows in file order (empty ones skipped).
+    """
+    sources = source if isinstance(source, list) else [source]
+    if sources and sources[0].endswith('.parquet'):
+        yield from parquet_store.iter_parquet(sources, columns, _stock_filter(stock_codes), chunk_rows)
+        return
+    usecols = (lambda c: c in columns) if columns is not None else None
+    for f in sources:
+        with pd.read_csv(f, usecols=usecols, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                chunk = _select(chunk, columns, stock_codes)
+                if len(chunk):
+                    yield chunk
+
+
+def list_inputs(input_path):
+    """
+    Raw inputs per file type: `{type}_*.csv` / `{type}_*.parquet` files in `input_path`,
+    plus the per-stock partitions under `{input_path}/{type}/` (partition_writer layout)
+    in chunks of PARTITION_CHUNK_SIZE.
+
+    :return: Dict of file type -> list of sources for read_raw
+    """
+    file_dict = {file_type: [] for file_type in FILE_TYPE_LIST}
+    for file_name in sorted(os.listdir(input_path)):
+        full_path = os.path.join(input_path, file_name)
+        if file_name in file_dict and os.path.isdir(full_path):
+            for ext in ('.csv', '.parquet'):
+                files = sorted(os.path.join(full_path, f) for f in os.listdir(full_path) if f.endswith(ext))
+                file_dict[file_name].extend(parquet_store.chunk_files(files, PARTITION_CHUNK_SIZE))
+            continue
         file_type = file_name.split('_')[0]
-        file_dict[file_type].append(file_name)
+        if file_type in file_dict and file_name.endswith(('.csv', '.parquet')):
+            file_dict[file_type].append(full_path)
+    return file_dict
+
+
+def load_and_clean(source, file_type, stock_codes=None):
+    """Read one raw input and run clean_df on it (runs in a worker process)."""
+    df = read_raw(source, RAW_COLUMNS, stock_codes)
+    return clean_df(df, file_type)
+
+
+def load_date_df(sources, stock_codes=None):
+    """
+    stock_date_df straight from the raw lrb inputs, reading only the columns it needs,
+    so it does not wait for lrb to be cleaned.
+    """
+    # one row per (stock, date, fiscal year end) per chunk keeps memory independent of the item count
+    frames = [chunk.drop_duplicates() for source in sources for chunk in iter_raw(source, DATE_COLUMNS, stock_codes)]
+    df = pd.concat(frames, ignore_index=True).drop_duplicates()
+    df['报表截止日'] = derived_flags.report_dates(df['报表截止日'])
+    return output_date_df(df)
+
+
+def combine_frames(futures):
+    """Gather the cleaned frames of one file type with a single concat."""
+    frames = [f.result() for f in futures]
+    return pd.concat(frames) if frames else pd.DataFrame()
+
+
+def finalize_type(combined_df, file_type, date_df, stock_df):
+    """
+    Add the latest/annual report flags, keep the latest and annual reports and sort.
+    """
+    print(file_type, ':', len(combined_df))
+    save_df = derived_flags.select_reports(combined_df, file_type, date_df, stock_df)
+    return save_df[OUTPUT_COLUMNS]
+
+
+def mark_version(output_path):
+    """Record that the outputs in `output_path` are complete and new, for readers caching them."""
+    path = os.path.join(output_path, VERSION_FILE)
+    with open(path + '.tmp', 'w') as f:
+        f.write(str(time.time_ns()))
+    os.replace(path + '.tmp', path)
+
+
+def _is_parquet(source):
+    return (source[0] if isinstance(source, list) else source).endswith('.parquet')
 
-    # Transform and Combine all files within a file type
-    for file_type in file_type_list:
-        file_list = file_dict[file_type]
-        combined_df = pd.DataFrame()
 
-        for file_name in file_list:
-            df = pd.read_csv(os.path.join(input_path, file_name))
-            combined_df = pd.concat([combined_df, clean_df(df, file_type)])
+def run_pipeline(input_path, output_path, stock_df, max_workers=None, storage_format='csv', stock_codes=None):
+    """
+    Transform every raw input in `input_path` and write one output file per type.
+
+    Inputs of all four types are cleaned in parallel in a process pool. Each type
+    is gathered once as soon as its inputs are done; stock_date_df is built from
+    lrb, and every type is finalized (concurrently) once it is available.
+
+    :param max_workers: Worker processes (default: CPU count)
+    :param storage_format: Output format, 'csv' or 'parquet' (needs pyarrow); inputs may be either
+    :param stock_codes: Only transform these stocks, None for all
+    """
+    file_dict = list_inputs(input_path)
+    os.makedirs(output_path, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as processes, ThreadPoolExecutor(max_workers=len(FILE_TYPE_LIST) + 1) as threads:
+        # Stage 1: clean every input (no dependencies)
+        clean_futures = {
+            file_type: [processes.submit(load_and_clean, source, file_type, stock_codes) for source in sources]
+            for file_type, sources in file_dict.items()
+        }
+        # Stage 2: gather each type once
+        combined_futures = {file_type: threads.submit(combine_frames, futures) for file_type, futures in clean_futures.items()}
 
-        if file_type == 'lrb':
-            date_df = output_date_df(combined_df)
+        # Stage 3: stock_date_df depends on lrb only; Parquet lrb is read directly with only the date columns
+        def build_date_df():
+            if file_dict['lrb'] and all(_is_parquet(source) for source in file_dict['lrb']):
+                date_df = load_date_df(file_dict['lrb'], stock_codes)
+            else:
+                date_df = output_date_df(combined_futures['lrb'].result())
             date_df.to_csv(os.path.join(output_path, 'stock_date_df.csv'), index=False)
-        
-        if file_type == 'zyzb':
-            combined_df = pd.merge(combined_df, date_df, on='股票代码', how='left')
-            combined_df['是否年报'] = np.where(combined_df['报表月'] == combined_df['年结月'], 1, 0)
-        else:
-            combined_df = pd.merge(combined_df, date_df[['股票代码', '最新报表截止日']], on='股票代码', how='left')
-        
-        print(file_type, ':', len(combined_df))
-        combined_df['是否最新报表'] = np.where(combined_df['报表截止日'] == combined_df['最新报表截止日'], 1, 0)
-        output_df = combined_df.loc[(combined_df['是否最新报表']==1) | (combined_df['是否年报']==1)]
-        output_df = pd.merge(output_df, stock_df, left_on='股票代码', right_on='股份代號')
-        save_df = output_df.sort_values(by=['股票代码','报表截止日', 'order_index'], ascending=[True, False, True]).drop_duplicates()
-        
-        output_columns = ['股票代码', '股份簡稱', '报表截止日', '年结月', '是否年报', '是否最新报表','指标组', '指标名称', '币种', '数值', 'value', 'order_index']
-        print(file_type, ':', len(save_df[output_columns]))
-        print(save_df[output_columns].head(5))
-        save_df[output_columns].to_csv(os.path.join(output_path, f'{file_type}_data.csv'), index=False)
-        
-
-
-
-    
\ No newline at end of file
+            return date_df
+        date_future = threads.submit(build_date_df)
+
+        # Stage 4: every type depends on its own frames and stock_date_df
+        def finalize_and_save(file_type):
+            combined_df = combined_futures[file_type].result()
+            if combined_df.empty:
+                print(f"No {file_type} files in {input_path}, skipping.")
+                return 0
+            save_df = finalize_type(combined_df, file_type, date_future.result(), stock_df)
+            print(file_type, ':', len(save_df))
+            print(save_df.head(5))
+            if storage_format == 'parquet':
+                parquet_store.write_parquet(save_df, os.path.join(output_path, f'{file_type}_data.parquet'))
+            else:
+                save_df.to_csv(os.path.join(output_path, f'{file_type}_data.csv'), index=False)
+            return len(save_df)
+        save_futures = {file_type: threads.submit(finalize_and_save, file_type) for file_type in FILE_TYPE_LIST}
+        counts = {file_type: f.result() for file_type, f in save_futures.items()}
+    mark_version(output_path)
+    return counts
+
+
+def list_stocks(sources):
+    """Sorted 5-digit codes of every stock in the inputs, reading only the stock column."""
+    stocks = set()
+    for source in sources:
+        for chunk in iter_raw(source, ['股票代码']):
+            stocks.update(tsc.transform_stock_code(chunk, '股票代码')['股票代码'].unique())
+    return sorted(stocks)
+
+
+def _order_key(df):
+    return pd.MultiIndex.from_frame(df[ORDER_COLUMNS].astype(object).fillna('\0'))
+
+
+def input_order(source, stock_codes=None):
+    """
+    order_index of one whole input, from a first pass over its 指标组 and 指标名称 columns only,
+    so chunks cleaned separately get the same order_index as clean_df on the whole input.
+
+    :return: Series of order_index by (指标组, 指标名称) in first-appearance order
+    """
+    columns = ORDER_COLUMNS + (['股票代码'] if stock_codes is not None else [])
+    pairs = [chunk[ORDER_COLUMNS].drop_duplicates() for chunk in iter_raw(source, columns, stock_codes)]
+    pairs = pd.concat(pairs).drop_duplicates() if pairs else pd.DataFrame(columns=ORDER_COLUMNS)
+    return pd.Series(np.arange(len(pairs)), index=_order_key(pairs))
+
+
+def clean_chunk(df, file_type, order):
+    """clean_df on a chunk of an input, with the input's order_index from input_order (runs in a worker process)."""
+    df = clean_df(df, file_type)
+    df['order_index'] = order.reindex(_order_key(df)).to_numpy()
+    return df
+
+
+def _spill(frame, buckets, bucket_of, spill_dir, file_type):
+    """Append the rows of one cleaned frame to the spill file of each stock chunk they belong to."""
+    for bucket, part in frame.groupby(frame['股票代码'].map(bucket_of), sort=False):
+        path = os.path.join(spill_dir, f'{file_type}_{bucket:05d}.pkl')
+        with open(path, 'ab') as f:
+            pickle.dump(part, f, protocol=pickle.HIGHEST_PROTOCOL)
+        buckets.add(bucket)
+
+
+def _load_spill(path):
+    frames = []
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                frames.append(pickle.load(f))
+            except EOFError:
+                return frames
+
+
+def run_streaming(input_path, output_path, stock_df, chunk_stocks=200, max_workers=None, storage_format='csv',
+                  stock_codes=None, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Same outputs as run_pipeline, with memory bounded by `chunk_rows` raw rows per worker and
+    one chunk of stocks instead of the whole history of a type.
+
+    stock_date_df is built first from the lrb dates alone. Every input is read `chunk_rows`
+    rows at a time: a first pass over its item columns gives the order_index of the whole
+    input (as in run_pipeline), then each chunk is cleaned and its rows are spilled to disk by
+    stock chunk; chunks of `chunk_stocks` stocks are finalized in stock order and appended
+    to the output, which is therefore already sorted.
+
+    :param chunk_stocks: Stocks per chunk
+    :param max_workers: Worker processes cleaning chunks (default: CPU count); at most this
+        many chunks are in flight at once
+    :param chunk_rows: Raw rows read and cleaned at a time
+    """
+    file_dict = list_inputs(input_path)
+    os.makedirs(output_path, exist_ok=True)
+
+    date_df = load_date_df(file_dict['lrb'], stock_codes)
+    date_df.to_csv(os.path.join(output_path, 'stock_date_df.csv'), index=False)
+
+    stocks = list_stocks([source for sources in file_dict.values() for source in sources])
+    if stock_codes is not None:
+        stocks = [s for s in stocks if s in set(stock_codes)]
+    bucket_of = {stock_code: i // chunk_stocks for i, stock_code in enumerate(stocks)}
+    max_workers = max_workers or os.cpu_count()
+
+    counts = {}
+    with tempfile.TemporaryDirectory(dir=output_path) as spill_dir, ProcessPoolExecutor(max_workers=max_workers) as processes:
+        for file_type in FILE_TYPE_LIST:
+            sources = file_dict[file_type]
+            if not sources:
+                print(f"No {file_type} files in {input_path}, skipping.")
+                counts[file_type] = 0
+                continue
+
+            # Clean inputs chunk by chunk in order, keeping at most max_workers chunks in flight
+            buckets = set()
+            in_flight = deque()
+            for source in sources:
+                order = input_order(source, stock_codes)
+                for chunk in iter_raw(source, RAW_COLUMNS, stock_codes, chunk_rows):
+                    in_flight.append(processes.submit(clean_chunk, chunk, file_type, order))
+                    if len(in_flight) >= max_workers:
+                        _spill(in_flight.popleft().result(), buckets, bucket_of, spill_dir, file_type)
+            while in_flight:
+                _spill(in_flight.popleft().result(), buckets, bucket_of, spill_dir, file_type)
+
+            # Finalize chunk by chunk and append
+            if storage_format == 'parquet':
+                out = parquet_store.ParquetAppender(os.path.join(output_path, f'{file_type}_data.parquet'))
+            else:
+                out_file = os.path.join(output_path, f'{file_type}_data.csv')
+            written = 0
+            for i, bucket in enumerate(sorted(buckets)):
+                path = os.path.join(spill_dir, f'{file_type}_{bucket:05d}.pkl')
+                save_df = finalize_type(pd.concat(_load_spill(path)), file_type, date_df, stock_df)
+                os.remove(path)
+                if storage_format == 'parquet':
+                    out.write(save_df)
+                else:
+                    save_df.to_csv(out_file, index=False, mode='a' if i else 'w', header=not i)
+                written += len(save_df)
+            if storage_format == 'parquet':
+                out.close()
+            print(file_type, ':', written)
+            counts[file_type] = written
+    mark_version(output_path)
+    return counts
+
+
+if __name__ == "__main__":
+    input_path = 'finance_data/'  # or partition_writer.PARTITION_PATH to read the partitions directly
+    output_path = 'transformed_finance_data/'
+    storage_format = 'csv'  # 'parquet' for typed, dictionary-encoded outputs
+    chunk_stocks = None  # e.g. 200 to stream stock chunks with bounded memory
+
+    stock_df = pd.read_csv('hk_stock_list_short.csv', dtype={"股份代號": str})
+    if chunk_stocks:
+        run_streaming(input_path, output_path, stock_df, chunk_stocks=chunk_stocks, storage_format=storage_format)
+    else:
+        run_pipeline(input_path, output_path, stock_df, storage_format=storage_format)